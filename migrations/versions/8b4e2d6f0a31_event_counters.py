@@ -0,0 +1,44 @@
+"""event counters
+
+Revision ID: 8b4e2d6f0a31
+Revises: 3f1c9a2b7d10
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e2d6f0a31'
+down_revision = '3f1c9a2b7d10'
+branch_labels = None
+depends_on = None
+
+COUNTERS = ('attendee_count', 'definitely_count', 'possibly_count', 'maybe_count',
+            'buying_count', 'selling_count', 'both_count', 'item_count')
+
+
+def upgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        for counter in COUNTERS:
+            batch_op.add_column(sa.Column(counter, sa.Integer(), nullable=False, server_default='0'))
+
+    # Fill the counters for existing events (same as `flask counters rebuild`)
+    op.execute(
+        "UPDATE events SET "
+        "attendee_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id), "
+        "definitely_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id AND a.attendance_likelihood = 'Definitely'), "
+        "possibly_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id AND a.attendance_likelihood = 'Possibly'), "
+        "maybe_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id AND a.attendance_likelihood = 'Maybe'), "
+        "buying_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id AND a.purpose = 'Buy'), "
+        "selling_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id AND a.purpose = 'Sell'), "
+        "both_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id AND a.purpose = 'Both'), "
+        "item_count = (SELECT COUNT(*) FROM event_items i WHERE i.event_id = events.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        for counter in reversed(COUNTERS):
+            batch_op.drop_column(counter)
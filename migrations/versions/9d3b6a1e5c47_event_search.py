@@ -0,0 +1,60 @@
+"""event search index
+
+Revision ID: 9d3b6a1e5c47
+Revises: f58b0c2e6a17
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3b6a1e5c47'
+down_revision = 'f58b0c2e6a17'
+branch_labels = None
+depends_on = None
+
+# Same tables as core/search.py creates. IF NOT EXISTS because older versions
+# created them on the first search, often without filling them, so they are
+# refilled here either way. MySQL uses the in-process index and needs nothing.
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS event_search USING fts5("
+            "title, location, items, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        op.execute('DELETE FROM event_search')
+        op.execute(
+            "INSERT INTO event_search (rowid, title, location, items) "
+            "SELECT events.id, events.event_title, events.location, COALESCE(items.names, '') FROM events "
+            "LEFT JOIN (SELECT event_id, group_concat(item_name, char(10)) AS names FROM event_items GROUP BY event_id) AS items "
+            "ON items.event_id = events.id"
+        )
+    elif dialect == 'postgresql':
+        op.execute(
+            'CREATE TABLE IF NOT EXISTS event_search ('
+            'event_id integer PRIMARY KEY REFERENCES events(id) ON DELETE CASCADE, '
+            'title tsvector NOT NULL, location tsvector NOT NULL, items tsvector NOT NULL, '
+            'document tsvector NOT NULL)'
+        )
+        op.execute('CREATE INDEX IF NOT EXISTS ix_event_search_document ON event_search USING GIN (document)')
+        op.execute('DELETE FROM event_search')
+        op.execute(
+            "INSERT INTO event_search (event_id, title, location, items, document) "
+            "SELECT id, to_tsvector('simple', event_title), to_tsvector('simple', location), "
+            "to_tsvector('simple', names), "
+            "setweight(to_tsvector('simple', event_title), 'A') || "
+            "setweight(to_tsvector('simple', location), 'B') || "
+            "setweight(to_tsvector('simple', names), 'C') "
+            "FROM (SELECT events.id, events.event_title, events.location, COALESCE(items.names, '') AS names FROM events "
+            "LEFT JOIN (SELECT event_id, string_agg(item_name, E'\\n') AS names FROM event_items GROUP BY event_id) AS items "
+            "ON items.event_id = events.id) AS documents"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name in ('sqlite', 'postgresql'):
+        op.execute('DROP TABLE IF EXISTS event_search')
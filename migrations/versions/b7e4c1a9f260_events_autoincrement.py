@@ -0,0 +1,39 @@
+"""events autoincrement
+
+Revision ID: b7e4c1a9f260
+Revises: 9d3b6a1e5c47
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4c1a9f260'
+down_revision = '9d3b6a1e5c47'
+branch_labels = None
+depends_on = None
+
+# Without AUTOINCREMENT SQLite hands out max(id) + 1, which can be the id of an
+# archived event once the newest hot events are archived or deleted. The
+# counter starts past every id in either table. PostgreSQL sequences and
+# MySQL 8 counters never go back, so they need nothing.
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('events', recreate='always', table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+    op.execute("DELETE FROM sqlite_sequence WHERE name = 'events'")
+    op.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'events', "
+        "MAX(COALESCE((SELECT MAX(id) FROM events), 0), COALESCE((SELECT MAX(id) FROM events_archive), 0))"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('events', recreate='always', table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+        pass
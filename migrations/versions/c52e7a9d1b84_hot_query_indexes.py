@@ -0,0 +1,50 @@
+"""hot query indexes
+
+Revision ID: c52e7a9d1b84
+Revises: 8b4e2d6f0a31
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52e7a9d1b84'
+down_revision = '8b4e2d6f0a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Double joins from before attendance was unique: keep the first one, and the counters in step
+    op.execute(
+        "DELETE FROM event_attendees WHERE id NOT IN ("
+        "SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM event_attendees GROUP BY event_id, user_id) AS firsts)"
+    )
+    op.execute(
+        "UPDATE events SET "
+        "attendee_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id), "
+        "definitely_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id AND a.attendance_likelihood = 'Definitely'), "
+        "possibly_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id AND a.attendance_likelihood = 'Possibly'), "
+        "maybe_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id AND a.attendance_likelihood = 'Maybe'), "
+        "buying_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id AND a.purpose = 'Buy'), "
+        "selling_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id AND a.purpose = 'Sell'), "
+        "both_count = (SELECT COUNT(*) FROM event_attendees a WHERE a.event_id = events.id AND a.purpose = 'Both')"
+    )
+
+    op.create_index('ix_events_created_date_id', 'events', ['created_date', 'id'])
+    op.create_index('ix_events_user_id_created_date', 'events', ['user_id', 'created_date', 'id'])
+    op.create_index('ix_events_event_date', 'events', ['event_date'])
+    op.create_index('uq_event_attendees_event_id_user_id', 'event_attendees', ['event_id', 'user_id'], unique=True)
+    op.create_index('ix_event_attendees_user_id_event_id', 'event_attendees', ['user_id', 'event_id'])
+    op.create_index('ix_event_items_event_id_user_id', 'event_items', ['event_id', 'user_id'])
+
+
+def downgrade():
+    op.drop_index('ix_event_items_event_id_user_id', table_name='event_items')
+    op.drop_index('ix_event_attendees_user_id_event_id', table_name='event_attendees')
+    op.drop_index('uq_event_attendees_event_id_user_id', table_name='event_attendees')
+    op.drop_index('ix_events_event_date', table_name='events')
+    op.drop_index('ix_events_user_id_created_date', table_name='events')
+    op.drop_index('ix_events_created_date_id', table_name='events')
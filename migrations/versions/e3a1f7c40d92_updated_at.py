@@ -0,0 +1,34 @@
+"""updated_at
+
+Revision ID: e3a1f7c40d92
+Revises: c52e7a9d1b84
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a1f7c40d92'
+down_revision = 'c52e7a9d1b84'
+branch_labels = None
+depends_on = None
+
+# Table -> the column existing rows take their updated_at from
+TABLES = (('users', 'CURRENT_TIMESTAMP'), ('events', 'created_date'), ('event_attendees', 'joined_date'))
+
+
+def upgrade():
+    for table, source in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute(f"UPDATE {table} SET updated_at = {source}")
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    for table, _ in reversed(TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('updated_at')
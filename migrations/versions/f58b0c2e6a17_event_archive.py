@@ -0,0 +1,76 @@
+"""event archive
+
+Revision ID: f58b0c2e6a17
+Revises: e3a1f7c40d92
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f58b0c2e6a17'
+down_revision = 'e3a1f7c40d92'
+branch_labels = None
+depends_on = None
+
+COUNTERS = ('attendee_count', 'definitely_count', 'possibly_count', 'maybe_count',
+            'buying_count', 'selling_count', 'both_count', 'item_count')
+
+
+def upgrade():
+    op.create_table('events_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created_date', sa.DateTime(), nullable=False),
+    sa.Column('event_title', sa.String(length=140), nullable=False),
+    sa.Column('event_description', sa.Text(), nullable=False),
+    sa.Column('event_date', sa.Date(), nullable=False),
+    sa.Column('event_time', sa.Time(), nullable=False),
+    sa.Column('location', sa.String(length=200), nullable=False),
+    *[sa.Column(counter, sa.Integer(), nullable=False) for counter in COUNTERS],
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('archived_date', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_events_archive_user_id_created_date', 'events_archive', ['user_id', 'created_date'], unique=False)
+
+    op.create_table('event_attendees_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('attendance_likelihood', sa.String(length=20), nullable=False),
+    sa.Column('purpose', sa.String(length=20), nullable=False),
+    sa.Column('items_bringing', sa.Text(), nullable=True),
+    sa.Column('joined_date', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['event_id'], ['events_archive.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_event_attendees_archive_event_id', 'event_attendees_archive', ['event_id'], unique=False)
+    op.create_index('ix_event_attendees_archive_user_id_event_id', 'event_attendees_archive', ['user_id', 'event_id'], unique=False)
+
+    op.create_table('event_items_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('item_name', sa.String(length=200), nullable=False),
+    sa.Column('added_date', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['event_id'], ['events_archive.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_event_items_archive_event_id_user_id', 'event_items_archive', ['event_id', 'user_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_event_items_archive_event_id_user_id', table_name='event_items_archive')
+    op.drop_table('event_items_archive')
+    op.drop_index('ix_event_attendees_archive_user_id_event_id', table_name='event_attendees_archive')
+    op.drop_index('ix_event_attendees_archive_event_id', table_name='event_attendees_archive')
+    op.drop_table('event_attendees_archive')
+    op.drop_index('ix_events_archive_user_id_created_date', table_name='events_archive')
+    op.drop_table('events_archive')
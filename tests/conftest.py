@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """The app on a scratch SQLite database filled by `flask seed`, with TESTING on."""
+    os.environ['DATABASE_URL'] = 'sqlite:///' + str(tmp_path_factory.mktemp('db') / 'greenhouse.db')
+    os.environ.setdefault('SECRET_KEY', 'testing')
+    os.environ['LIVE_UPDATES'] = '0'
+    from the_greenhouse import create_app, db
+    app = create_app()
+    app.config.update(TESTING = True, WTF_CSRF_ENABLED = False)
+    with app.app_context():
+        db.create_all()
+    result = app.test_cli_runner().invoke(args = ['seed', '--users', '200', '--events', '2000'])
+    assert result.exit_code == 0, result.output
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+@pytest.fixture
+def client(app):
+    from the_greenhouse import cache
+    # Anonymous feed pages are cached, which would hide their queries
+    cache.clear()
+    return app.test_client()
@@ -0,0 +1,10 @@
+from werkzeug.security import generate_password_hash
+
+def test_current_hash_is_not_rehashed(app):
+    from the_greenhouse import hasher
+    # The configured method may be shorthand that Werkzeug expands when hashing
+    assert not hasher.needs_rehash(hasher.hash('password'))
+
+def test_older_hash_is_rehashed(app):
+    from the_greenhouse import hasher
+    assert hasher.needs_rehash(generate_password_hash('password', 'pbkdf2:sha256:1000'))
@@ -0,0 +1,19 @@
+import pytest
+from sqlalchemy import create_engine
+from the_greenhouse.query_plans import check_plans, hot_queries, seed_scratch
+
+# Big enough that SQLite's planner prefers a full scan wherever an index is missing
+EVENTS = 20000
+
+@pytest.fixture(scope='module')
+def plans():
+    engine = create_engine('sqlite://')
+    seed_scratch(engine, EVENTS)
+    with engine.connect() as connection:
+        yield check_plans(connection)
+    engine.dispose()
+
+@pytest.mark.parametrize('name', [name for name, _, _ in hot_queries()])
+def test_hot_query_uses_an_index(plans, name):
+    passed, plan, scans = plans[name]
+    assert passed, f'{name} scans a whole table: {scans}\n' + '\n'.join(plan)
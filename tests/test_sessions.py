@@ -0,0 +1,6 @@
+def test_malformed_session_user_id(client):
+    # Flask-Login keeps the id in the session as a string
+    with client.session_transaction() as session:
+        session['_user_id'] = 'not-a-number'
+        session['_fresh'] = True
+    assert client.get('/').status_code == 200
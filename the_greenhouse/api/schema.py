@@ -0,0 +1,70 @@
+from flask_restful import abort, fields
+
+# Event fields a client can ask for with ?fields=; 'author' is the author's username
+EVENT_FIELDS = {
+    'id': fields.Integer,
+    'user_id': fields.Integer,
+    'author': fields.String(attribute = 'author.username'),
+    'event_title': fields.String,
+    'event_description': fields.String,
+    'event_date': fields.String,
+    'event_time': fields.String,
+    'location': fields.String,
+    'created_date': fields.DateTime(dt_format = 'iso8601'),
+    'attendee_count': fields.Integer,
+    'definitely_count': fields.Integer,
+    'possibly_count': fields.Integer,
+    'maybe_count': fields.Integer,
+    'buying_count': fields.Integer,
+    'selling_count': fields.Integer,
+    'both_count': fields.Integer,
+    'item_count': fields.Integer,
+}
+
+# Related rows a client can add with ?include=, each loaded with one query per table for the whole page
+ATTENDEE_FIELDS = {
+    'user_id': fields.Integer,
+    'username': fields.String,
+    'attendance_likelihood': fields.String,
+    'purpose': fields.String,
+    'joined_date': fields.DateTime(dt_format = 'iso8601'),
+}
+
+ITEM_FIELDS = {
+    'id': fields.Integer,
+    'user_id': fields.Integer,
+    'username': fields.String,
+    'item_name': fields.String,
+    'added_date': fields.DateTime(dt_format = 'iso8601'),
+}
+
+INCLUDES = {'attendees': ATTENDEE_FIELDS, 'items': ITEM_FIELDS}
+
+def _names(value, allowed, parameter):
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        abort(400, message = f"Unknown {parameter}: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    # Keep the client's order, without repeats
+    return list(dict.fromkeys(names))
+
+def event_fields(value):
+    """?fields=id,event_title -> the marshal fields for those names; every field when not given."""
+    if not value:
+        return dict(EVENT_FIELDS)
+    return {name: EVENT_FIELDS[name] for name in _names(value, EVENT_FIELDS, 'fields')}
+
+def includes(value):
+    return _names(value, INCLUDES, 'include') if value else []
+
+def id_list(value, limit, parameter = 'ids'):
+    """?ids=3,1,2 -> [3, 1, 2], at most limit of them."""
+    try:
+        ids = [int(part) for part in (value or '').split(',') if part.strip()]
+    except ValueError:
+        abort(400, message = f'{parameter} must be a comma separated list of integers')
+    if not ids:
+        abort(400, message = f'{parameter} is required')
+    if len(ids) > limit:
+        abort(400, message = f'At most {limit} {parameter} per request')
+    return list(dict.fromkeys(ids))
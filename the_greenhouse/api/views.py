@@ -0,0 +1,268 @@
+from collections import defaultdict
+from datetime import date
+from functools import wraps
+
+from flask import Blueprint, current_app, request
+from flask_jwt_extended import create_access_token, get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from flask_restful import Api, Resource, abort, marshal
+from jwt.exceptions import InvalidTokenError
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, load_only
+from the_greenhouse import db
+from the_greenhouse.models import (User, Events, EventAttendee, EventItem, EventArchive,
+                                   EventAttendeeArchive, EventItemArchive, AnyEvent)
+from the_greenhouse.api.schema import INCLUDES, event_fields, includes, id_list
+from the_greenhouse.pagination import keyset_paginate
+from the_greenhouse.query_budget import query_budget
+from the_greenhouse.replicas import read_only
+from the_greenhouse.core.feed_cache import invalidate_event
+from the_greenhouse.posts.counters import apply_counters, item_deltas
+from the_greenhouse.posts.items import sync_items
+from the_greenhouse.posts.broadcast import publish_attendee
+
+api = Blueprint('api', __name__, url_prefix = '/api/v1')
+rest = Api(api)
+
+# Where ?include= reads from, for hot and archived events
+HOT = {'attendees': EventAttendee, 'items': EventItem}
+ARCHIVED = {'attendees': EventAttendeeArchive, 'items': EventItemArchive}
+
+def authenticated(method):
+    # Bearer token from /api/v1/auth/token; JWT errors would otherwise come out of flask-restful as 500s
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            verify_jwt_in_request()
+        except (JWTExtendedException, InvalidTokenError) as error:
+            abort(401, message = str(error) or 'Invalid token')
+        return method(*args, **kwargs)
+    return wrapper
+
+def _query_args():
+    selected = event_fields(request.args.get('fields'))
+    return selected, includes(request.args.get('include'))
+
+def _per_page():
+    per_page = request.args.get('per_page', 20, type = int)
+    return max(1, min(per_page, current_app.config['API_MAX_PER_PAGE']))
+
+def _event_query(model, selected):
+    # Only the asked for columns, plus what cursors and includes need
+    columns = {'id', 'user_id', 'created_date'} | {name for name in selected if name != 'author'}
+    options = [load_only(*[getattr(model, name) for name in columns])]
+    if 'author' in selected:
+        options.append(joinedload(model.author).load_only(User.username))
+    return select(model).options(*options)
+
+def _related_rows(name, model, ids):
+    if name == 'attendees':
+        columns = (model.user_id, model.attendance_likelihood, model.purpose, model.joined_date)
+    else:
+        columns = (model.id, model.user_id, model.item_name, model.added_date)
+    return db.session.execute(
+        select(model.event_id, User.username, *columns)
+        .join(User, User.id == model.user_id)
+        .where(model.event_id.in_(ids))
+        .order_by(model.id)
+    )
+
+def _serialize(events, selected, include, hot_ids = (), archived_ids = ()):
+    """Marshal events with the selected fields, and each included relation loaded in one query per table."""
+    related = {name: defaultdict(list) for name in include}
+    for name in include:
+        for tables, ids in ((HOT, hot_ids), (ARCHIVED, archived_ids)):
+            if ids:
+                for row in _related_rows(name, tables[name], ids):
+                    related[name][row.event_id].append(marshal(row._mapping, INCLUDES[name]))
+    data = []
+    for event in events:
+        fields = marshal(event, selected)
+        for name in include:
+            fields[name] = related[name][event.id]
+        data.append(fields)
+    return data
+
+def _page(page, data):
+    return {'data': data, 'next_cursor': page.next_cursor, 'prev_cursor': page.prev_cursor}
+
+def _date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        abort(400, message = f'{name} must be a date (YYYY-MM-DD)')
+
+class TokenResource(Resource):
+
+    def post(self):
+        payload = request.get_json(silent = True) or {}
+        email, password = payload.get('email'), payload.get('password')
+        if not isinstance(email, str) or not isinstance(password, str):
+            abort(400, message = 'email and password are required')
+        user = db.session.execute(select(User).filter_by(email = email)).scalar_one_or_none()
+        if user is None or not user.check_password(password):
+            abort(401, message = 'Invalid email or password')
+        if user.upgrade_password(password):
+            db.session.commit()
+        expires = current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+        return {'access_token': create_access_token(identity = str(user.id)),
+                'token_type': 'Bearer',
+                'expires_in': int(expires.total_seconds())}
+
+class EventListResource(Resource):
+    method_decorators = [query_budget(3), read_only]
+
+    def get(self):
+        # Upcoming events newest first, like the home feed
+        selected, include = _query_args()
+        query = _event_query(Events, selected).where(Events.event_date >= (_date_arg('date_from') or date.today()))
+        date_to = _date_arg('date_to')
+        if date_to is not None:
+            query = query.where(Events.event_date <= date_to)
+        page = keyset_paginate(query, (Events.created_date, Events.id), cursor = request.args.get('cursor'),
+                               per_page = _per_page(), total = None)
+        return _page(page, _serialize(page.items, selected, include, hot_ids = [event.id for event in page.items]))
+
+class EventBatchResource(Resource):
+    method_decorators = [query_budget(6), read_only]
+
+    def get(self):
+        """Many events by id in one call, hot or archived, in the order asked for."""
+        ids = id_list(request.args.get('ids'), current_app.config['API_BATCH_MAX'])
+        selected, include = _query_args()
+        found = {event.id: event for event in db.session.scalars(_event_query(Events, selected).where(Events.id.in_(ids)))}
+        hot_ids = list(found)
+        missing = [event_id for event_id in ids if event_id not in found]
+        if missing:
+            # Past events are moved to the archive tables by `flask archive run`
+            query = _event_query(EventArchive, selected).where(EventArchive.id.in_(missing))
+            found.update((event.id, event) for event in db.session.scalars(query))
+        archived_ids = [event_id for event_id in found if event_id not in hot_ids]
+        events = [found[event_id] for event_id in ids if event_id in found]
+        return {'data': _serialize(events, selected, include, hot_ids, archived_ids),
+                'missing': [event_id for event_id in ids if event_id not in found]}
+
+class EventResource(Resource):
+    method_decorators = [query_budget(4), read_only]
+
+    def get(self, event_id):
+        selected, include = _query_args()
+        event = db.session.scalar(_event_query(Events, selected).where(Events.id == event_id))
+        if event is not None:
+            return {'data': _serialize([event], selected, include, hot_ids = [event.id])[0]}
+        event = db.session.scalar(_event_query(EventArchive, selected).where(EventArchive.id == event_id))
+        if event is None:
+            abort(404, message = f'Event {event_id} not found')
+        return {'data': _serialize([event], selected, include, archived_ids = [event.id])[0]}
+
+class UserEventsResource(Resource):
+    method_decorators = [query_budget(6), read_only]
+
+    def get(self, username):
+        selected, include = _query_args()
+        user_id = db.session.scalar(select(User.id).where(User.username == username))
+        if user_id is None:
+            abort(404, message = f'User {username} not found')
+        # Older events may have been archived, AnyEvent reads both tables
+        query = _event_query(AnyEvent, selected).where(AnyEvent.user_id == user_id)
+        page = keyset_paginate(query, (AnyEvent.created_date, AnyEvent.id), cursor = request.args.get('cursor'),
+                               per_page = _per_page(), total = None)
+        ids = [event.id for event in page.items]
+        # Either table can hold a page's events; each lookup is one indexed IN
+        return _page(page, _serialize(page.items, selected, include, hot_ids = ids, archived_ids = ids))
+
+def _item_entries(entries):
+    """Validate [{"event_id": 1, "items": ["Tomatoes", ...]}, ...] into [(event_id, [item, ...])]."""
+    limit = current_app.config['API_BATCH_MAX']
+    if not isinstance(entries, list) or not entries:
+        abort(400, message = 'events must be a non-empty list')
+    if len(entries) > limit:
+        abort(400, message = f'At most {limit} events per request')
+    validated = {}
+    for entry in entries:
+        event_id = entry.get('event_id') if isinstance(entry, dict) else None
+        items = entry.get('items') if isinstance(entry, dict) else None
+        if not isinstance(event_id, int) or not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+            abort(400, message = 'Each entry needs an integer event_id and a list of item names')
+        items = [item.strip() for item in items if item.strip()]
+        # Stored one per line in items_bringing, and in a 200 character column
+        if any('\n' in item or len(item) > 200 for item in items):
+            abort(400, message = 'Item names are one line of at most 200 characters')
+        if event_id in validated:
+            abort(400, message = f'Event {event_id} appears more than once')
+        validated[event_id] = items
+    return list(validated.items())
+
+def replace_items(user_id, entries):
+    """Set user_id's item list for several events in one transaction.
+
+    Nothing is written unless the user attends every event with a purpose
+    that allows bringing items. Attendances and existing items are each read
+    with one query for the whole batch, then each event gets only the
+    INSERT/DELETE for what changed (posts.items.sync_items).
+    """
+    ids = [event_id for event_id, _ in entries]
+    rows = db.session.execute(
+        select(EventAttendee, Events)
+        .join(Events, Events.id == EventAttendee.event_id)
+        .where(EventAttendee.user_id == user_id, EventAttendee.event_id.in_(ids))
+    ).all()
+    attending = {attendee.event_id: (attendee, event) for attendee, event in rows}
+
+    errors = []
+    for event_id, items in entries:
+        if event_id not in attending:
+            errors.append({'event_id': event_id, 'message': 'You are not attending this event, or it has been archived'})
+        elif items and attending[event_id][0].purpose not in ('Sell', 'Both'):
+            errors.append({'event_id': event_id, 'message': 'Only attendees selling items can bring items'})
+    if errors:
+        abort(422, message = 'No items were changed', errors = errors)
+
+    existing = defaultdict(list)
+    for event_id, item_id, name in db.session.execute(
+        select(EventItem.event_id, EventItem.id, EventItem.item_name)
+        .where(EventItem.user_id == user_id, EventItem.event_id.in_(ids))
+    ):
+        existing[event_id].append((item_id, name))
+
+    changed = []
+    for event_id, items in entries:
+        attendee, event = attending[event_id]
+        items_bringing = '\n'.join(items) or None
+        apply_counters(event, item_deltas(sync_items(event, user_id, items_bringing, existing = existing[event_id])))
+        if attendee.items_bringing != items_bringing:
+            attendee.items_bringing = items_bringing
+            changed.append(event_id)
+    db.session.commit()
+    for event_id in changed:
+        invalidate_event(event_id, items = True)
+        publish_attendee(event_id, user_id)
+    return [{'event_id': event_id, 'items': items} for event_id, items in entries]
+
+class ItemBatchResource(Resource):
+    method_decorators = [authenticated]
+
+    def put(self):
+        """Replace the caller's items for several events: {"events": [{"event_id": 1, "items": [...]}, ...]}."""
+        payload = request.get_json(silent = True) or {}
+        entries = _item_entries(payload.get('events'))
+        return {'data': replace_items(int(get_jwt_identity()), entries)}
+
+class EventItemsResource(Resource):
+    method_decorators = [authenticated]
+
+    def put(self, event_id):
+        payload = request.get_json(silent = True) or {}
+        entries = _item_entries([{'event_id': event_id, 'items': payload.get('items')}])
+        return {'data': replace_items(int(get_jwt_identity()), entries)[0]}
+
+rest.add_resource(TokenResource, '/auth/token', endpoint = 'token')
+rest.add_resource(EventListResource, '/events', endpoint = 'events')
+rest.add_resource(EventBatchResource, '/events/batch', endpoint = 'events_batch')
+rest.add_resource(EventResource, '/events/<int:event_id>', endpoint = 'event')
+rest.add_resource(EventItemsResource, '/events/<int:event_id>/items', endpoint = 'event_items')
+rest.add_resource(UserEventsResource, '/users/<username>/events', endpoint = 'user_events')
+rest.add_resource(ItemBatchResource, '/items', endpoint = 'items_batch')
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import delete, func, insert, literal, select, union_all, and_
+from the_greenhouse import db
+from the_greenhouse.models import (Events, EventAttendee, EventItem,
+                                   EventArchive, EventAttendeeArchive, EventItemArchive)
+from the_greenhouse.core.search import mark_dirty
+from the_greenhouse.file_lock import try_lock
+
+# Hot table -> archive table, parents first
+TABLES = ((Events, EventArchive), (EventAttendee, EventAttendeeArchive), (EventItem, EventItemArchive))
+
+def attended_events(user_id, start = None, end = None):
+    """Subquery of the events user_id attends, hot and archived, optionally between two dates.
+
+    Columns: id, event_title, event_description, event_date, event_time,
+    location, attendance_likelihood. The date range is applied to each side
+    so both use their (user_id, event_id) index.
+    """
+    def side(event, attendee):
+        conditions = [attendee.user_id == user_id]
+        if start is not None:
+            conditions.append(event.event_date >= start)
+        if end is not None:
+            conditions.append(event.event_date <= end)
+        return (select(event.id, event.event_title, event.event_description, event.event_date,
+                       event.event_time, event.location, attendee.attendance_likelihood)
+                .join(attendee, event.id == attendee.event_id)
+                .where(and_(*conditions)))
+    return union_all(side(Events, EventAttendee), side(EventArchive, EventAttendeeArchive)).subquery('attended')
+
+def _move(ids, archived_date):
+    for hot, cold in TABLES:
+        if hot is Events:
+            key = hot.id
+            columns = list(hot.__table__.c) + [literal(archived_date, EventArchive.archived_date.type)]
+            names = [column.name for column in hot.__table__.c] + ['archived_date']
+        else:
+            # Attendees and items get new ids in the archive; only event ids appear in URLs
+            key = hot.event_id
+            columns = [column for column in hot.__table__.c if column.name != 'id']
+            names = [column.name for column in columns]
+        db.session.execute(insert(cold.__table__).from_select(names, select(*columns).where(key.in_(ids))))
+    # Children first for the foreign keys
+    for hot, _ in reversed(TABLES):
+        key = hot.id if hot is Events else hot.event_id
+        db.session.execute(delete(hot).where(key.in_(ids)).execution_options(synchronize_session = False))
+
+def archive_events(before, batch_size, max_batches, dry_run = False):
+    """Move events dated before `before`, with their attendees and items, to the archive tables.
+
+    Each batch of events moves in its own transaction, so readers see an
+    event either hot or archived, never both or neither.
+    """
+    metrics = {'events': 0, 'attendees': 0, 'items': 0, 'batches': 0}
+    # Archived ids aren't handed out again: events is AUTOINCREMENT on SQLite, and
+    # PostgreSQL sequences and MySQL 8 counters never go back
+    due = select(Events.id).where(Events.event_date < before)
+    if dry_run:
+        metrics['events'] = db.session.scalar(select(func.count()).select_from(due.subquery()))
+        metrics['attendees'] = db.session.scalar(select(func.count(EventAttendee.id)).where(EventAttendee.event_id.in_(due)))
+        metrics['items'] = db.session.scalar(select(func.count(EventItem.id)).where(EventItem.event_id.in_(due)))
+        return metrics
+    while metrics['batches'] < max_batches:
+        ids = db.session.scalars(due.order_by(Events.event_date, Events.id).limit(batch_size)).all()
+        if not ids:
+            break
+        metrics['attendees'] += db.session.scalar(select(func.count(EventAttendee.id)).where(EventAttendee.event_id.in_(ids)))
+        metrics['items'] += db.session.scalar(select(func.count(EventItem.id)).where(EventItem.event_id.in_(ids)))
+        _move(ids, datetime.now(timezone.utc))
+        # Drops them from the search index at commit
+        mark_dirty(db.session, ids)
+        db.session.commit()
+        metrics['events'] += len(ids)
+        metrics['batches'] += 1
+    return metrics
+
+def run_archive(dry_run = False):
+    config = current_app.config
+    # Only one process archives at a time
+    with try_lock(os.path.join(current_app.instance_path, 'archive.lock')) as locked:
+        if not locked:
+            return None
+        started = time.perf_counter()
+        before = date.today() - timedelta(days=config['ARCHIVE_AFTER_DAYS'])
+        metrics = archive_events(before, config['ARCHIVE_BATCH_SIZE'], config['ARCHIVE_MAX_BATCHES'], dry_run)
+        metrics['before'] = before.isoformat()
+        metrics['seconds'] = round(time.perf_counter() - started, 3)
+    current_app.logger.info('Archive%s: %s', ' (dry run)' if dry_run else '', metrics)
+    return metrics
+
+def _archive_loop(app, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                run_archive()
+            except Exception:
+                app.logger.exception('Archive run failed')
+            finally:
+                db.session.remove()
+
+archive_cli = AppGroup('archive', help='Move past events out of the hot tables.')
+
+@archive_cli.command('run')
+@click.option('--dry-run', is_flag=True, help='Report what would be archived without moving it.')
+def run_command(dry_run):
+    """Archive events more than ARCHIVE_AFTER_DAYS in the past. Run it daily (cron, Heroku Scheduler)."""
+    metrics = run_archive(dry_run)
+    if metrics is None:
+        click.echo('Another archive run is in progress.')
+        return
+    click.echo(f"{'Would archive' if dry_run else 'Archived'} {metrics['events']} events dated before {metrics['before']} "
+               f"({metrics['attendees']} attendees, {metrics['items']} items) in {metrics['seconds']}s")
+
+@archive_cli.command('stats')
+def stats_command():
+    """Row counts of the hot and archive tables."""
+    for hot, cold in TABLES:
+        hot_rows = db.session.scalar(select(func.count()).select_from(hot))
+        cold_rows = db.session.scalar(select(func.count()).select_from(cold))
+        click.echo(f'{hot.__tablename__:16} {hot_rows:>10} hot {cold_rows:>10} archived')
+
+def init_app(app):
+    app.cli.add_command(archive_cli)
+    interval = app.config['ARCHIVE_INTERVAL']
+    if interval:
+        threading.Thread(target=_archive_loop, args=(app, interval), name='archive', daemon=True).start()
@@ -0,0 +1,252 @@
+import contextvars
+import http.cookiejar
+import json
+import re
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select, and_, not_, exists
+from the_greenhouse import db
+from the_greenhouse.models import User, Events, EventAttendee
+from the_greenhouse.query_budget import count_queries
+from the_greenhouse.seed import SEED_PASSWORD
+
+CSRF_TOKEN = re.compile(rb'name="csrf_token" type="hidden" value="([^"]+)"')
+
+class TestClientSession:
+    """Sends requests through Flask's test client and counts the queries each one runs."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data = None):
+        with count_queries() as counter:
+            response = self.client.open(path, method = method, data = data)
+        return response.status_code, response.get_data(), counter.count
+
+class HttpSession:
+    """Sends requests to a running server (e.g. local gunicorn). Queries can't be counted from outside."""
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self._NoRedirect())
+
+    def request(self, method, path, data = None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data = body, method = method)
+        try:
+            with self.opener.open(request, timeout = 30) as response:
+                return response.status, response.read(), None
+        except urllib.error.HTTPError as error:
+            return error.code, error.read(), None
+
+def csrf_token(session, path):
+    match = CSRF_TOKEN.search(session.request('GET', path)[1])
+    return match.group(1).decode() if match else ''
+
+def login(session, email, password):
+    status = session.request('POST', '/login', {'csrf_token': csrf_token(session, '/login'),
+                                                'email': email, 'password': password})[0]
+    if status != 302:
+        raise click.ClickException(f'Could not log in as {email} (status {status})')
+
+class Fixtures:
+    """Ids and names from the database for the routes to use."""
+
+    def __init__(self, email, workers):
+        today = date.today()
+        if email:
+            self.user = db.session.scalar(select(User).where(User.email == email))
+        else:
+            # Someone who has created events, so their pages and the update form have content
+            self.user = db.session.scalar(select(User).where(User.id == select(Events.user_id).limit(1).scalar_subquery()))
+        if self.user is None:
+            raise click.ClickException('No users found; run `flask seed` first.')
+        self.username = self.user.username
+        self.own_event = db.session.scalar(select(Events.id).where(Events.user_id == self.user.id).limit(1))
+        self.busiest_event = db.session.scalar(select(Events.id).order_by(Events.attendee_count.desc()).limit(1))
+        self.events = db.session.scalars(select(Events.id).order_by(Events.created_date.desc()).limit(50)).all()
+        # One event per worker for the join/unattend cycle, so workers don't trip over each other
+        self.joinable = db.session.scalars(
+            select(Events.id).where(and_(
+                Events.user_id != self.user.id,
+                Events.event_date >= today,
+                not_(exists().where(and_(EventAttendee.event_id == Events.id, EventAttendee.user_id == self.user.id))),
+            )).limit(workers)
+        ).all()
+        self.popular_item = 'basil'
+
+def build_routes(fixtures, writes):
+    """[(name, logged_in, request(session, worker, iteration) -> (method, path, data))]"""
+    f = fixtures
+
+    def get(path):
+        return lambda session, worker, i: ('GET', path, None)
+
+    def event_path(session, worker, i):
+        return 'GET', f'/event/{f.events[i % len(f.events)]}', None
+
+    routes = [
+        ('core.index', False, get('/')),
+        ('core.index page 2', False, get('/2')),
+        ('core.index search', False, get(f'/?items_search={f.popular_item}')),
+        ('core.index dates', False, get('/?date_from=2000-01-01&date_to=2100-01-01')),
+        ('core.info', False, get('/info')),
+        ('posts.event', False, event_path),
+        ('posts.event busiest', False, get(f'/event/{f.busiest_event}')),
+        ('users.user_events', False, get(f'/{f.username}')),
+        ('users.login', False, get('/login')),
+        ('users.register', False, get('/register')),
+        ('core.index logged in', True, get('/')),
+        ('posts.event logged in', True, event_path),
+        ('posts.create_event', True, get('/create_event')),
+        ('users.account', True, get('/account')),
+    ]
+    if f.own_event:
+        routes.append(('posts.update', True, get(f'/event/{f.own_event}/update')))
+    if f.joinable:
+        routes.append(('posts.join_event form', True, get(f'/event/{f.joinable[0]}/join')))
+    if writes and f.joinable:
+        def join_or_leave(session, worker, i):
+            event_id = f.joinable[worker % len(f.joinable)]
+            if i % 2:
+                return 'POST', f'/event/{event_id}/unattend', {}
+            return 'POST', f'/event/{event_id}/join', {
+                'csrf_token': session.csrf_token, 'attendance_likelihood': 'Maybe',
+                'purpose': 'Sell', 'items_bringing': 'basil\nmint\nfern'}
+        routes.append(('posts.join/unattend', True, join_or_leave))
+    return routes
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def run_route(sessions, request_for, requests):
+    """Send requests through the sessions in parallel, one thread per session."""
+    latencies, queries, errors = [], [], []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker(index, session):
+        # Each worker takes the next iteration number, so the total is exact
+        for i in counter:
+            method, path, data = request_for(session, index, i)
+            started = time.perf_counter()
+            status, _, query_count = session.request(method, path, data)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if query_count is not None:
+                    queries.append(query_count)
+                if status >= 500 or status in (403, 404):
+                    errors.append(status)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(index, session)) for index, session in enumerate(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+        'rps': round(len(latencies) / wall, 1),
+        'queries': round(statistics.mean(queries), 1) if queries else None,
+        'errors': len(errors),
+    }
+
+def compare(results, baseline, tolerance):
+    """Lines describing regressions against baseline: p95 over tolerance, more queries, new errors."""
+    problems = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            problems.append(f"{name}: p95 {base['p95_ms']}ms -> {result['p95_ms']}ms")
+        if result['queries'] is not None and base.get('queries') is not None and result['queries'] > base['queries']:
+            problems.append(f"{name}: queries per request {base['queries']} -> {result['queries']}")
+        if result['errors'] > base.get('errors', 0):
+            problems.append(f"{name}: errors {base.get('errors', 0)} -> {result['errors']}")
+    return problems
+
+bench_cli = AppGroup('bench', help='Benchmark every route.')
+
+@bench_cli.command('run')
+@click.option('--requests', '-n', default=200, show_default=True, help='Requests per route.')
+@click.option('--concurrency', '-c', default=4, show_default=True, help='Simultaneous clients.')
+@click.option('--url', default=None, help='Benchmark a running server (e.g. gunicorn on http://127.0.0.1:8000) instead of the test client.')
+@click.option('--email', default=None, help='User to log in as (default: a user who has created events).')
+@click.option('--password', default=SEED_PASSWORD, show_default=True)
+@click.option('--writes', is_flag=True, help='Also join and unattend events.')
+@click.option('--only', default=None, help='Only routes whose name contains this.')
+@click.option('--out', type=click.Path(dir_okay=False), default=None, help='Write the results as JSON.')
+@click.option('--baseline', type=click.Path(dir_okay=False), default=None, help='Compare against results saved earlier.')
+@click.option('--save-baseline', is_flag=True, help='Store these results as the new --baseline.')
+@click.option('--tolerance', default=0.2, show_default=True, help='Allowed p95 slowdown against the baseline (0.2 = 20%).')
+def run_command(requests, concurrency, url, email, password, writes, only, out, baseline, save_baseline, tolerance):
+    """Drive every core, posts and users route and report latency, throughput and queries per request."""
+    app = current_app._get_current_object()
+    fixtures = Fixtures(email, concurrency)
+    routes = build_routes(fixtures, writes)
+    if only:
+        routes = [route for route in routes if only in route[0]]
+
+    def new_session():
+        return HttpSession(url) if url else TestClientSession(app)
+
+    anonymous = [new_session() for _ in range(concurrency)]
+    logged_in = [new_session() for _ in range(concurrency)]
+    for session in logged_in:
+        # Outside the command's app context, or every request would share its g (and CSRF token)
+        contextvars.Context().run(login, session, fixtures.user.email, password)
+        session.csrf_token = contextvars.Context().run(csrf_token, session, '/create_event')
+
+    target = url or 'test client'
+    click.echo(f'{len(routes)} routes x {requests} requests, concurrency {concurrency}, against {target}, as {fixtures.username}')
+    click.echo(f"{'route':28} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8} {'errors':>7}")
+    results = {}
+    for name, needs_login, request_for in routes:
+        result = run_route(logged_in if needs_login else anonymous, request_for, requests)
+        results[name] = result
+        queries = '-' if result['queries'] is None else result['queries']
+        click.echo(f"{name:28} {result['p50_ms']:8} {result['p95_ms']:8} {result['p99_ms']:8} "
+                   f"{result['rps']:8} {queries:>8} {result['errors']:7}")
+    db.session.remove()
+
+    report = {'target': target, 'requests': requests, 'concurrency': concurrency,
+              'database': db.engine.url.get_backend_name(), 'routes': results}
+    if out:
+        with open(out, 'w') as handle:
+            json.dump(report, handle, indent=2)
+    if baseline and save_baseline:
+        with open(baseline, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        click.echo(f'Saved baseline to {baseline}')
+    elif baseline:
+        with open(baseline) as handle:
+            problems = compare(results, json.load(handle)['routes'], tolerance)
+        if problems:
+            for problem in problems:
+                click.echo(f'REGRESSION {problem}')
+            raise click.ClickException(f'{len(problems)} regressions against {baseline}')
+        click.echo(f'No regressions against {baseline}')
+
+def init_app(app):
+    app.cli.add_command(bench_cli)
@@ -0,0 +1,151 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+class MemoryCache:
+    """In-process LRU cache with per-entry TTL and tag based invalidation.
+
+    Each gunicorn worker holds its own copy. It is the default backend and the
+    local stand-in for RedisCache.
+    """
+
+    def __init__(self, max_entries = 1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (value, expires_at, tags)
+        self.tags = {}  # tag -> set of keys
+        self.lock = threading.Lock()
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            for tag in entry[2]:
+                keys = self.tags.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.tags[tag]
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.monotonic():
+                self._discard(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl = None, tags = ()):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self._discard(key)
+            self.entries[key] = (value, expires_at, tuple(tags))
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._discard(next(iter(self.entries)))
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self._discard(key)
+
+    def invalidate_tags(self, *tags):
+        with self.lock:
+            for tag in tags:
+                for key in list(self.tags.get(tag, ())):
+                    self._discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+class RedisCache:
+    """Cache shared by every worker, backed by Redis (requires the redis package)."""
+
+    def __init__(self, url, prefix = 'greenhouse:', default_ttl = 300):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl = None, tags = ()):
+        ttl = ttl or self.default_ttl
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, pickle.dumps(value), ex = ttl)
+        for tag in tags:
+            # Tag sets outlive their entries slightly, stale members are harmless
+            pipe.sadd(self.prefix + 'tag:' + tag, key)
+            pipe.expire(self.prefix + 'tag:' + tag, ttl * 2)
+        pipe.execute()
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def invalidate_tags(self, *tags):
+        for tag in tags:
+            tag_key = self.prefix + 'tag:' + tag
+            keys = self.client.smembers(tag_key)
+            pipe = self.client.pipeline()
+            if keys:
+                pipe.delete(*[self.prefix + key.decode() for key in keys])
+            pipe.delete(tag_key)
+            pipe.execute()
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+class Cache:
+    """Flask extension wrapping the configured cache backend.
+
+    CACHE_BACKEND is 'memory' (default), 'redis' (uses CACHE_REDIS_URL) or
+    'null' to turn caching off.
+    """
+
+    def __init__(self, app = None):
+        self.backend = None
+        self.default_ttl = 300
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.default_ttl = app.config['CACHE_DEFAULT_TTL']
+        backend = app.config['CACHE_BACKEND']
+        if backend == 'redis':
+            self.backend = RedisCache(app.config['CACHE_REDIS_URL'], default_ttl = self.default_ttl)
+        elif backend == 'null':
+            self.backend = None
+        else:
+            self.backend = MemoryCache(app.config['CACHE_MAX_ENTRIES'])
+        app.extensions['cache'] = self
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        return self.backend.get(key)
+
+    def set(self, key, value, ttl = None, tags = ()):
+        if self.backend is not None:
+            self.backend.set(key, value, ttl or self.default_ttl, tags)
+
+    def delete(self, *keys):
+        if self.backend is not None:
+            self.backend.delete(*keys)
+
+    def invalidate_tags(self, *tags):
+        if self.backend is not None:
+            self.backend.invalidate_tags(*tags)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
@@ -0,0 +1,101 @@
+import hashlib
+from datetime import date, datetime, time, timezone
+from functools import wraps
+
+from flask import Response, current_app, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import func, or_, select, update
+from the_greenhouse import db
+from the_greenhouse.models import User, Events, EventAttendee
+
+def _utc(value):
+    # DateTime columns come back naive, holding UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+def event_version(event_id):
+    """(parts, last_modified) for posts.event, from Events.updated_at alone. None if the event doesn't exist.
+
+    Everything else on the page bumps that column when it changes: joins,
+    leaves and purpose changes through apply_counters, items through
+    sync_items, and attendee names and pictures through touch_user_events.
+    """
+    updated_at = db.session.scalar(select(Events.updated_at).where(Events.id == event_id))
+    if updated_at is None:
+        return None
+    # The join button depends on whether the event has passed
+    today = date.today()
+    return (event_id, today, _utc(updated_at)), max(_utc(updated_at), datetime.combine(today, time(), timezone.utc))
+
+def touch_events(*conditions):
+    # Bump updated_at on the matching events, so their pages get a new version
+    db.session.execute(
+        update(Events).where(*conditions)
+        .values(updated_at = datetime.now(timezone.utc))
+        .execution_options(synchronize_session = False)
+    )
+
+def touch_user_events(user_id):
+    """Bump every event page that shows user_id, after a username or picture change."""
+    attending = select(EventAttendee.event_id).where(EventAttendee.user_id == user_id)
+    touch_events(or_(Events.user_id == user_id, Events.id.in_(attending)))
+
+def user_events_version(username):
+    """(parts, last_modified) for users.user_events. None if there's no such user."""
+    row = db.session.execute(
+        select(
+            User.updated_at,
+            select(func.count(Events.id)).where(Events.user_id == User.id).scalar_subquery(),
+            select(func.max(Events.updated_at)).where(Events.user_id == User.id).scalar_subquery(),
+        ).where(User.username == username)
+    ).first()
+    if row is None:
+        return None
+    updated_at, count, events_updated_at = row
+    stamps = [_utc(stamp) for stamp in (updated_at, events_updated_at) if stamp is not None]
+    return (username, count, *stamps), max(stamps)
+
+def _viewer():
+    # Pages show who is logged in, and the join/edit buttons depend on it
+    if current_user.is_authenticated:
+        return current_user.id, current_user.username, current_user.profile_image
+    return None
+
+def conditional(version_of):
+    """Answer If-None-Match / If-Modified-Since with 304 before the view runs.
+
+    version_of gets the view's arguments and returns (parts, last_modified)
+    from one cheap query, or None to leave it to the view (e.g. to 404).
+    The ETag covers parts, the viewer and RELEASE_VERSION, so a deploy or
+    logging in shows the page afresh. Pages with pending flash messages
+    are always rendered.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+            version = version_of(*args, **kwargs)
+            if version is None:
+                return view(*args, **kwargs)
+            parts, last_modified = version
+            key = repr((request.full_path, parts, _viewer(), current_app.config['RELEASE_VERSION']))
+            etag = hashlib.sha1(key.encode()).hexdigest()
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = request.if_modified_since is not None and request.if_modified_since >= last_modified.replace(microsecond=0)
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,55 @@
+from flask import render_template, request, session
+from flask_login import current_user
+from markupsafe import Markup
+from the_greenhouse import cache
+
+# Cache tags used by the home feed:
+#   'feed'          every cached feed page
+#   'feed-search'   feed pages filtered by any search parameter
+#   'feed-items'    feed pages filtered by items being brought
+#   'event:<id>'    the event's card and every cached page showing it
+#   'user:<id>'     cards and pages showing events created by the user
+
+def render_event_card(event):
+    key = f'card:{event.id}'
+    html = cache.get(key)
+    if html is None:
+        html = render_template('event_card.html', event=event)
+        cache.set(key, html, tags=(f'event:{event.id}', f'user:{event.user_id}'))
+    return Markup(html)
+
+def page_cache_key():
+    # Logged in users and pending flash messages change the page around the feed
+    if current_user.is_authenticated or session.get('_flashes'):
+        return None
+    return 'feed:' + request.full_path
+
+def page_tags(events, filtered, items_filtered):
+    tags = {'feed'}
+    if filtered:
+        tags.add('feed-search')
+    if items_filtered:
+        tags.add('feed-items')
+    for event in events:
+        tags.add(f'event:{event.id}')
+        tags.add(f'user:{event.user_id}')
+    return tags
+
+def invalidate_event(event_id, feed=False, search=False, items=False):
+    """Drop cached cards and feed pages after a write to event_id.
+
+    feed for changes that move events in or out of every page (create, delete),
+    search for changes that can alter which searches match, items for changes
+    to the items being brought.
+    """
+    tags = [f'event:{event_id}']
+    if feed:
+        tags.append('feed')
+    if search:
+        tags.append('feed-search')
+    if items:
+        tags.append('feed-items')
+    cache.invalidate_tags(*tags)
+
+def invalidate_user(user_id):
+    cache.invalidate_tags(f'user:{user_id}')
@@ -0,0 +1,424 @@
+import bisect
+import math
+import re
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import Float, Integer, case, event, false, inspect, select, text
+from the_greenhouse import db
+from the_greenhouse.models import Events, EventItem
+
+# Search fields and the request argument each one is read from in core.index
+FIELDS = ('title', 'location', 'items')
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+search_cli = AppGroup('search', help='Manage the event search index.')
+
+
+def tokenize(value):
+    return [token.lower() for token in TOKEN_RE.findall(value or '')]
+
+
+def load_documents(session, event_ids):
+    # Returns {event_id: {'title': ..., 'location': ..., 'items': ...}} for events that still exist
+    docs = {}
+    if not event_ids:
+        return docs
+    rows = session.execute(
+        select(Events.id, Events.event_title, Events.location).where(Events.id.in_(event_ids))
+    )
+    for event_id, title, location in rows:
+        docs[event_id] = {'title': title, 'location': location, 'items': []}
+    items = session.execute(
+        select(EventItem.event_id, EventItem.item_name).where(EventItem.event_id.in_(list(docs)))
+    ) if docs else []
+    for event_id, item_name in items:
+        docs[event_id]['items'].append(item_name)
+    for doc in docs.values():
+        doc['items'] = '\n'.join(doc['items'])
+    return docs
+
+
+class SqliteSearch:
+    """FTS5 virtual table keyed by event id (rowid)."""
+
+    name = 'sqlite'
+    transactional = True
+
+    def setup(self, session):
+        # Returns True if the table was created (and so is empty)
+        exists = session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'event_search'")
+        ).scalar()
+        if exists:
+            return False
+        session.execute(text(
+            "CREATE VIRTUAL TABLE event_search USING fts5("
+            "title, location, items, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        return True
+
+    def write(self, session, docs, removed):
+        ids = list(docs) + list(removed)
+        if ids:
+            session.execute(
+                text('DELETE FROM event_search WHERE rowid = :event_id'),
+                [{'event_id': event_id} for event_id in ids]
+            )
+        if docs:
+            session.execute(
+                text('INSERT INTO event_search (rowid, title, location, items) '
+                     'VALUES (:event_id, :title, :location, :items)'),
+                [dict(doc, event_id=event_id) for event_id, doc in docs.items()]
+            )
+
+    def clear(self, session):
+        session.execute(text('DELETE FROM event_search'))
+
+    def apply(self, query, terms):
+        # Every token must match as a prefix within its own column, like the old ilike filters
+        expression = ' AND '.join(
+            f'{field} : "{token}"*' for field, tokens in terms.items() for token in tokens
+        )
+        matches = text(
+            'SELECT rowid AS event_id, bm25(event_search, 10.0, 5.0, 1.0) AS rank '
+            'FROM event_search WHERE event_search MATCH :expression'
+        ).bindparams(expression=expression).columns(event_id=Integer, rank=Float).subquery()
+        query = query.join(matches, matches.c.event_id == Events.id)
+        # bm25 scores are negative, lower is a better match
+        return query, matches.c.rank
+
+
+class PostgresSearch:
+    """Weighted tsvector per event with a GIN index."""
+
+    name = 'postgres'
+    transactional = True
+
+    def setup(self, session):
+        exists = session.execute(text("SELECT to_regclass('event_search')")).scalar()
+        if exists:
+            return False
+        session.execute(text(
+            'CREATE TABLE event_search ('
+            'event_id integer PRIMARY KEY REFERENCES events(id) ON DELETE CASCADE, '
+            'title tsvector NOT NULL, location tsvector NOT NULL, items tsvector NOT NULL, '
+            'document tsvector NOT NULL)'
+        ))
+        session.execute(text(
+            'CREATE INDEX ix_event_search_document ON event_search USING GIN (document)'
+        ))
+        return True
+
+    def write(self, session, docs, removed):
+        if removed:
+            session.execute(
+                text('DELETE FROM event_search WHERE event_id = :event_id'),
+                [{'event_id': event_id} for event_id in removed]
+            )
+        if docs:
+            session.execute(
+                text(
+                    "INSERT INTO event_search (event_id, title, location, items, document) "
+                    "SELECT :event_id, to_tsvector('simple', :title), to_tsvector('simple', :location), "
+                    "to_tsvector('simple', :items), "
+                    "setweight(to_tsvector('simple', :title), 'A') || "
+                    "setweight(to_tsvector('simple', :location), 'B') || "
+                    "setweight(to_tsvector('simple', :items), 'C') "
+                    "ON CONFLICT (event_id) DO UPDATE SET title = EXCLUDED.title, "
+                    "location = EXCLUDED.location, items = EXCLUDED.items, document = EXCLUDED.document"
+                ),
+                [dict(doc, event_id=event_id) for event_id, doc in docs.items()]
+            )
+
+    def clear(self, session):
+        session.execute(text('DELETE FROM event_search'))
+
+    def apply(self, query, terms):
+        params = {}
+        field_filters = []
+        all_tokens = []
+        for field, tokens in terms.items():
+            params[field] = ' & '.join(f'{token}:*' for token in tokens)
+            field_filters.append(f"{field} @@ to_tsquery('simple', :{field})")
+            all_tokens.extend(tokens)
+        params['document'] = ' & '.join(f'{token}:*' for token in all_tokens)
+        # The GIN index narrows on the whole document, the per-field checks only recheck candidates
+        matches = text(
+            "SELECT event_id, ts_rank(document, to_tsquery('simple', :document)) AS rank "
+            "FROM event_search WHERE document @@ to_tsquery('simple', :document) AND "
+            + ' AND '.join(field_filters)
+        ).bindparams(**params).columns(event_id=Integer, rank=Float).subquery()
+        query = query.join(matches, matches.c.event_id == Events.id)
+        return query, matches.c.rank.desc()
+
+
+class MemorySearch:
+    """In-process inverted index, used when the database has no full-text support.
+
+    Each worker process holds its own copy, so it is rebuilt from the database
+    every SEARCH_MEMORY_TTL seconds to pick up writes made by other workers.
+    Rebuilds run in a background thread started by the first search; only
+    that first build is waited for, later searches use the current copy.
+    """
+
+    name = 'memory'
+    transactional = False
+    # Longest a search waits for the first build before going ahead without it
+    first_build_timeout = 30
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.built = threading.Event()
+        self.refresher = None
+        self.documents = {}
+        self.postings = {field: {} for field in FIELDS}
+        self.vocabulary = {field: [] for field in FIELDS}
+
+    def setup(self, session):
+        return False
+
+    def _add(self, event_id, doc):
+        tokens = {field: tokenize(doc[field]) for field in FIELDS}
+        self.documents[event_id] = tokens
+        for field, field_tokens in tokens.items():
+            for token in field_tokens:
+                postings = self.postings[field].get(token)
+                if postings is None:
+                    postings = self.postings[field][token] = {}
+                    bisect.insort(self.vocabulary[field], token)
+                postings[event_id] = postings.get(event_id, 0) + 1
+
+    def _remove(self, event_id):
+        tokens = self.documents.pop(event_id, None)
+        if tokens is None:
+            return
+        for field, field_tokens in tokens.items():
+            for token in set(field_tokens):
+                postings = self.postings[field].get(token)
+                if postings is None:
+                    continue
+                postings.pop(event_id, None)
+                if not postings:
+                    del self.postings[field][token]
+                    index = bisect.bisect_left(self.vocabulary[field], token)
+                    del self.vocabulary[field][index]
+
+    def rebuild(self, session):
+        event_ids = session.scalars(select(Events.id)).all()
+        # Built aside and swapped in, so searches aren't held up while it runs
+        fresh = MemorySearch(self.ttl)
+        for event_id, doc in load_documents(session, event_ids).items():
+            fresh._add(event_id, doc)
+        with self.lock:
+            self.documents, self.postings, self.vocabulary = fresh.documents, fresh.postings, fresh.vocabulary
+        self.built.set()
+
+    def start(self, app):
+        with self.lock:
+            # Started here rather than at import so it runs in the gunicorn worker, not the master
+            if self.refresher is None:
+                self.refresher = threading.Thread(target=self._refresh, args=(app,), name='search-refresher', daemon=True)
+                self.refresher.start()
+
+    def _refresh(self, app):
+        while True:
+            with app.app_context():
+                try:
+                    self.rebuild(db.session)
+                except Exception:
+                    app.logger.exception('Search index rebuild failed')
+                finally:
+                    db.session.remove()
+            time.sleep(self.ttl)
+
+    def write(self, session, docs, removed):
+        with self.lock:
+            for event_id in list(docs) + list(removed):
+                self._remove(event_id)
+            for event_id, doc in docs.items():
+                self._add(event_id, doc)
+
+    def clear(self, session):
+        with self.lock:
+            self.documents = {}
+            self.postings = {field: {} for field in FIELDS}
+            self.vocabulary = {field: [] for field in FIELDS}
+
+    def _prefix_matches(self, field, token):
+        # All postings for vocabulary entries that start with token
+        vocabulary = self.vocabulary[field]
+        matches = {}
+        index = bisect.bisect_left(vocabulary, token)
+        while index < len(vocabulary) and vocabulary[index].startswith(token):
+            for event_id, count in self.postings[field][vocabulary[index]].items():
+                matches[event_id] = matches.get(event_id, 0) + count
+            index += 1
+        return matches
+
+    def scores(self, terms):
+        total = max(len(self.documents), 1)
+        scores = None
+        for field, tokens in terms.items():
+            for token in tokens:
+                matches = self._prefix_matches(field, token)
+                idf = math.log(1 + total / (1 + len(matches)))
+                if scores is None:
+                    scores = {event_id: count * idf for event_id, count in matches.items()}
+                else:
+                    scores = {event_id: score + matches[event_id] * idf
+                              for event_id, score in scores.items() if event_id in matches}
+                if not scores:
+                    return {}
+        return scores or {}
+
+    def apply(self, query, terms):
+        if not self.built.is_set():
+            self.start(current_app._get_current_object())
+            self.built.wait(self.first_build_timeout)
+        with self.lock:
+            scores = self.scores(terms)
+        if not scores:
+            return query.where(false()), None
+        query = query.where(Events.id.in_(list(scores)))
+        return query, case(scores, value=Events.id, else_=0).desc()
+
+
+def get_backend():
+    backend = current_app.extensions.get('search')
+    if backend is None:
+        choice = current_app.config['SEARCH_BACKEND']
+        if choice == 'auto':
+            choice = {'sqlite': 'sqlite', 'postgresql': 'postgres'}.get(db.engine.dialect.name, 'memory')
+        if choice == 'sqlite':
+            backend = SqliteSearch()
+        elif choice == 'postgres':
+            backend = PostgresSearch()
+        else:
+            backend = MemorySearch(current_app.config['SEARCH_MEMORY_TTL'])
+        current_app.extensions['search'] = backend
+    return backend
+
+
+def create_index(connection):
+    """Create and fill the search table for the connection's database if it is missing.
+
+    Migrations create it on migrated databases; this covers db.create_all()
+    (app.py, scratch databases) and `flask search rebuild`. It is never run
+    from a request, so the DDL can't end up in a rolled back read or on a replica.
+    """
+    backend = {'sqlite': SqliteSearch, 'postgresql': PostgresSearch}.get(connection.dialect.name)
+    if backend is None or not backend().setup(connection):
+        return False
+    event_ids = connection.execute(select(Events.id)).scalars().all()
+    backend().write(connection, load_documents(connection, event_ids), [])
+    return True
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_with_tables(target, connection, **kw):
+    create_index(connection)
+
+
+def search_events(query, search_name='', search_location='', search_items=''):
+    """Restrict an Events select to the search terms.
+
+    Returns the filtered query and a rank expression to order by (best match
+    first), or None for the rank when no search terms were given.
+    """
+    terms = {}
+    for field, value in zip(FIELDS, (search_name, search_location, search_items)):
+        if value:
+            terms[field] = tokenize(value)
+            if not terms[field]:
+                # Nothing searchable was typed (e.g. only punctuation)
+                return query.where(false()), None
+    if not terms:
+        return query, None
+    return get_backend().apply(query, terms)
+
+
+def mark_dirty(session, event_ids):
+    """Queue events for reindexing at commit time.
+
+    ORM writes to Events and EventItem are picked up automatically; code that
+    changes items with bulk statements has to call this itself.
+    """
+    session.info.setdefault('search_dirty', set()).update(event_ids)
+
+
+def _indexed_change(obj):
+    # Counter and updated_at changes leave the document as it was
+    attrs = inspect(obj).attrs
+    return attrs.event_title.history.has_changes() or attrs.location.history.has_changes()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changes(session, flush_context):
+    dirty = set()
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Events):
+            dirty.add(obj.id)
+        elif isinstance(obj, EventItem):
+            dirty.add(obj.event_id)
+    for obj in session.dirty:
+        if isinstance(obj, Events) and _indexed_change(obj):
+            dirty.add(obj.id)
+        elif isinstance(obj, EventItem) and inspect(obj).attrs.item_name.history.has_changes():
+            dirty.add(obj.event_id)
+    dirty.discard(None)
+    if dirty:
+        mark_dirty(session, dirty)
+
+
+@event.listens_for(db.session, 'before_commit')
+def _write_index(session):
+    # Flush first so changes still pending at commit time are collected too
+    session.flush()
+    if not session.info.get('search_dirty'):
+        return
+    event_ids = session.info.pop('search_dirty')
+    backend = get_backend()
+    docs = load_documents(session, event_ids)
+    removed = [event_id for event_id in event_ids if event_id not in docs]
+    if backend.transactional:
+        backend.write(session, docs, removed)
+    else:
+        # In-memory index only changes once the transaction is known to have committed
+        session.info['search_pending'] = (docs, removed)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_pending(session):
+    pending = session.info.pop('search_pending', None)
+    if pending is not None and current_app.extensions.get('search') is not None:
+        current_app.extensions['search'].write(session, *pending)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop('search_dirty', None)
+    session.info.pop('search_pending', None)
+
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Rebuild the search index from the events and items tables, creating it if it is missing."""
+    backend = get_backend()
+    backend.setup(db.session)
+    if isinstance(backend, MemorySearch):
+        backend.rebuild(db.session)
+    else:
+        backend.clear(db.session)
+        backend.write(db.session, load_documents(db.session, db.session.scalars(select(Events.id)).all()), [])
+    db.session.commit()
+    click.echo(f'Rebuilt {backend.name} search index.')
+
+
+def init_app(app):
+    app.cli.add_command(search_cli)
@@ -1,30 +1,43 @@
-from flask import render_template, Blueprint, request
-from the_greenhouse import db
-from the_greenhouse.models import Events, EventItem
-from sqlalchemy import select, desc, and_, or_
+from flask import render_template, Blueprint, request, current_app
+from the_greenhouse import db, cache
+from the_greenhouse.models import Events
+from the_greenhouse.core.search import search_events
+from the_greenhouse.query_profiles import load_profile
+from the_greenhouse.query_budget import query_budget
+from the_greenhouse.replicas import read_only
+from the_greenhouse.pagination import keyset_paginate
+from the_greenhouse.core.feed_cache import render_event_card, page_cache_key, page_tags
+from sqlalchemy import select, desc
 from datetime import date
 
 core = Blueprint('core', __name__)
 
+@core.app_template_global('event_card')
+def event_card(event):
+    return render_event_card(event)
+
 @core.route('/')
 @core.route('/<int:page>')
+@read_only
+@query_budget(5)
 def index(page=1):
+    # Anonymous feed pages are served straight from the cache
+    cache_key = page_cache_key()
+    if cache_key is not None:
+        html = cache.get(cache_key)
+        if html is not None:
+            return html
+    
     # Get search parameters from request
     search_name = request.args.get('event_name', '').strip()
     search_location = request.args.get('location', '').strip()
     search_items = request.args.get('items_search', '').strip()
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
+    filtered = search_name or search_location or search_items or date_from or date_to
     
     # Start with base query - only future events
-    query = select(Events).filter(Events.event_date >= date.today())
-    
-    # Apply search filters
-    if search_name:
-        query = query.filter(Events.event_title.ilike(f'%{search_name}%'))
-    
-    if search_location:
-        query = query.filter(Events.location.ilike(f'%{search_location}%'))
+    query = select(Events).options(*load_profile('event_feed')).filter(Events.event_date >= date.today())
     
     if date_from:
         try:
@@ -40,26 +53,38 @@ def index(page=1):
         except ValueError:
             pass  # Invalid date format, ignore
     
-    # Search by items being brought
-    if search_items:
-        # Join with EventItem table to search by items
-        query = query.join(EventItem, Events.id == EventItem.event_id).filter(
-            EventItem.item_name.ilike(f'%{search_items}%')).distinct()
-    
-    # Order by creation date (newest first)
-    query = query.order_by(desc(Events.created_date))
+    # Search title, location and items being brought through the search index
+    query, rank = search_events(query, search_name, search_location, search_items)
     
-    # Paginate results
-    events = db.paginate(
-        query,
-        page=page,
-        per_page=10,
-        error_out=False
-    )
+    if rank is None and page == 1 and current_app.config['PAGINATION_MODE'] == 'keyset':
+        # Newest first by (created_date, id) cursor - only count results when showing search results
+        events = keyset_paginate(
+            query,
+            (Events.created_date, Events.id),
+            cursor=request.args.get('cursor'),
+            per_page=10,
+            total='cached' if filtered else None
+        )
+    else:
+        # Best matches first when searching, then by creation date (newest first)
+        if rank is not None:
+            query = query.order_by(rank)
+        query = query.order_by(desc(Events.created_date))
+        
+        # Paginate results
+        events = db.paginate(
+            query,
+            page=page,
+            per_page=10,
+            error_out=False
+        )
 
-    return render_template('home.html', events=events, 
+    html = render_template('home.html', events=events, 
                          search_name=search_name, search_location=search_location, 
                          search_items=search_items, date_from=date_from, date_to=date_to)
+    if cache_key is not None:
+        cache.set(cache_key, html, tags=page_tags(events.items, filtered, search_items))
+    return html
 
 @core.route('/info')
 def info():
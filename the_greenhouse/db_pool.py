@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+# Per-driver defaults, each can be overridden with the DB_* environment variable of the same name
+DRIVER_DEFAULTS = {
+    # Heroku Postgres plans allow 20 (mini/basic) to a few hundred connections across every dyno
+    'postgresql': {'pool_size': 5, 'max_overflow': 2, 'pool_timeout': 10, 'pool_recycle': 1800,
+                   'pool_pre_ping': True, 'statement_timeout_ms': 15000, 'connect_timeout': 5},
+    # Recycle before MySQL's wait_timeout closes idle connections on its side
+    'mysql': {'pool_size': 5, 'max_overflow': 5, 'pool_timeout': 10, 'pool_recycle': 280,
+              'pool_pre_ping': True, 'statement_timeout_ms': 15000, 'connect_timeout': 5},
+    # A local file, so connections are cheap; the timeout is how long to wait on a locked database
+    'sqlite': {'pool_size': 5, 'max_overflow': 10, 'pool_timeout': 10, 'pool_recycle': -1,
+               'pool_pre_ping': False, 'statement_timeout_ms': 0, 'connect_timeout': 15},
+}
+
+def normalize_database_url(database_url):
+    # Heroku still hands out postgres:// URLs, which SQLAlchemy no longer accepts
+    if database_url.startswith('postgres://'):
+        return 'postgresql://' + database_url[len('postgres://'):]
+    return database_url
+
+def _setting(name, default):
+    value = os.getenv('DB_' + name.upper())
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return type(default)(value)
+
+def engine_options(database_url):
+    """SQLALCHEMY_ENGINE_OPTIONS for database_url, from the driver defaults and DB_* overrides."""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    settings = {name: _setting(name, default) for name, default in DRIVER_DEFAULTS.get(backend, DRIVER_DEFAULTS['postgresql']).items()}
+    statement_timeout_ms = settings.pop('statement_timeout_ms')
+    connect_timeout = settings.pop('connect_timeout')
+
+    if backend == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            # Flask-SQLAlchemy sets up a single shared connection for in-memory databases
+            return {}
+        return dict(settings, poolclass = TimedQueuePool, connect_args = {'timeout': connect_timeout})
+
+    if backend == 'postgresql':
+        connect_args = {'connect_timeout': connect_timeout}
+        if statement_timeout_ms:
+            connect_args['options'] = f'-c statement_timeout={statement_timeout_ms}'
+    else:
+        connect_args = {'connect_timeout': connect_timeout}
+        if statement_timeout_ms:
+            # Applies to SELECTs, which is where runaway queries come from
+            connect_args['init_command'] = f'SET SESSION max_execution_time={statement_timeout_ms}'
+    return dict(settings, poolclass = TimedQueuePool, connect_args = connect_args)
+
+class PoolStats:
+    """Counters for how long requests wait to get a connection from the pool."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited, timed_out = False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'checkouts_total': self.checkouts,
+                'checkout_timeouts_total': self.timeouts,
+                'checkout_wait_seconds_total': round(self.wait_total, 6),
+                'checkout_wait_seconds_max': round(self.wait_max, 6),
+            }
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout took, including opening new connections."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            self.stats.record(time.perf_counter() - started, timed_out = True)
+            raise
+        self.stats.record(time.perf_counter() - started)
+        return connection
+
+def pool_stats(engine):
+    """Current state of engine's pool in this process, or None for pools without sizing."""
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return None
+    stats = {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        # Negative while the pool is still filling up to size
+        'overflow': pool.overflow(),
+        'max_overflow': pool._max_overflow,
+    }
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.stats.snapshot())
+    return stats
+
+pool_cli = AppGroup('pool', help='Database connection pool tools.')
+
+@pool_cli.command('stats')
+def stats_command():
+    """Show the engine options and this process's pool counters."""
+    from the_greenhouse import db
+    options = current_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    click.echo(f'url: {db.engine.url.render_as_string(hide_password = True)}')
+    for name, value in options.items():
+        click.echo(f'{name}: {getattr(value, "__name__", value)}')
+    # Check out one connection so the counters show something
+    with db.engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+    for name, value in (pool_stats(db.engine) or {}).items():
+        click.echo(f'{name}: {value}')
+
+@pool_cli.command('plan')
+@click.option('--workers', default = int(os.getenv('WEB_CONCURRENCY', 2)), show_default = True, help = 'gunicorn worker processes per dyno.')
+@click.option('--dynos', default = 1, show_default = True, help = 'Web dynos (or machines) running the app.')
+@click.option('--extra', default = 2, show_default = True, help = 'Connections kept free for release tasks, psql, etc.')
+def plan_command(workers, dynos, extra):
+    """Compare the most connections the app can open with the server's limit."""
+    from the_greenhouse import db
+    pool = db.engine.pool
+    if not isinstance(pool, QueuePool):
+        click.echo('The engine does not use a sized pool.')
+        return
+    per_worker = pool.size() + max(pool._max_overflow, 0)
+    needed = per_worker * workers * dynos + extra
+    click.echo(f'{per_worker} connections per worker x {workers} workers x {dynos} dynos + {extra} = {needed}')
+
+    limit = None
+    backend = db.engine.url.get_backend_name()
+    with db.engine.connect() as connection:
+        if backend == 'postgresql':
+            limit = int(connection.execute(text('SHOW max_connections')).scalar())
+        elif backend == 'mysql':
+            limit = int(connection.execute(text("SHOW VARIABLES LIKE 'max_connections'")).one()[1])
+    if limit is None:
+        click.echo(f'{backend} has no server connection limit to check against.')
+    elif needed > limit:
+        click.echo(f'Over the server limit of {limit}: lower DB_POOL_SIZE/DB_MAX_OVERFLOW or the worker count.')
+    else:
+        click.echo(f'Within the server limit of {limit}.')
+
+def init_app(app):
+    app.cli.add_command(pool_cli)
@@ -8,4 +8,12 @@ def error_404(error):
 
 @error_pages.app_errorhandler(403)
 def error_403(error):
-    return render_template('error_pages/403.html'), 403
\ No newline at end of file
+    return render_template('error_pages/403.html'), 403
+
+@error_pages.app_errorhandler(413)
+def error_413(error):
+    return render_template('error_pages/413.html'), 413
+
+@error_pages.app_errorhandler(503)
+def error_503(error):
+    return render_template('error_pages/503.html', error = error), 503
\ No newline at end of file
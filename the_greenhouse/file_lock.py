@@ -0,0 +1,30 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+    msvcrt = None
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+@contextmanager
+def try_lock(path):
+    """Hold an exclusive lock on the file at path for the block.
+
+    Yields False straight away, without waiting, when another process holds
+    it. The lock goes with the file handle, so it is released if the process dies.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as lock:
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(lock.fileno(), msvcrt.LK_NBLCK, 1)
+        except (BlockingIOError, PermissionError):
+            # PermissionError is how msvcrt reports a lock held elsewhere
+            yield False
+            return
+        yield True
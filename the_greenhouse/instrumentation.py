@@ -0,0 +1,189 @@
+import sys
+import threading
+import time
+import tracemalloc
+
+from flask import Response, abort, current_app, g, has_app_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import resource
+except ImportError:
+    # Windows has no getrusage
+    resource = None
+
+# Request duration histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestStats:
+    """What one request spent its time on, kept on g while it runs."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.queries = []  # (seconds, statement)
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.template_started = 0.0
+
+class Metrics:
+    """Per-process totals by endpoint, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}  # (endpoint, method, status) -> count
+        self.durations = {}  # endpoint -> [bucket counts..., sum, count]
+        self.sql_count = {}
+        self.sql_seconds = {}
+        self.template_seconds = {}
+        self.slow = {}
+
+    def record(self, endpoint, method, status, seconds, stats, slow):
+        with self.lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.durations.setdefault(endpoint, [0] * len(BUCKETS) + [0.0, 0])
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[index] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            self.sql_count[endpoint] = self.sql_count.get(endpoint, 0) + stats.sql_count
+            self.sql_seconds[endpoint] = self.sql_seconds.get(endpoint, 0.0) + stats.sql_seconds
+            self.template_seconds[endpoint] = self.template_seconds.get(endpoint, 0.0) + stats.template_seconds
+            if slow:
+                self.slow[endpoint] = self.slow.get(endpoint, 0) + 1
+
+    def render(self, pool = None):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP greenhouse_{name} {help_text}')
+            lines.append(f'# TYPE greenhouse_{name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{value_}"' for key, value_ in labels)
+                lines.append(f'greenhouse_{name}{{{label_text}}} {value}' if label_text else f'greenhouse_{name} {value}')
+
+        with self.lock:
+            metric('requests_total', 'counter', 'Requests handled, by endpoint, method and status.',
+                   [((('endpoint', e), ('method', m), ('status', s)), n) for (e, m, s), n in sorted(self.requests.items())])
+            lines.append('# HELP greenhouse_request_duration_seconds Request duration.')
+            lines.append('# TYPE greenhouse_request_duration_seconds histogram')
+            for endpoint, histogram in sorted(self.durations.items()):
+                for bound, count in zip(BUCKETS, histogram):
+                    lines.append(f'greenhouse_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                lines.append(f'greenhouse_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {histogram[-1]}')
+                lines.append(f'greenhouse_request_duration_seconds_sum{{endpoint="{endpoint}"}} {histogram[-2]:.6f}')
+                lines.append(f'greenhouse_request_duration_seconds_count{{endpoint="{endpoint}"}} {histogram[-1]}')
+            for name, help_text, values in (
+                ('sql_queries_total', 'SQL statements executed.', self.sql_count),
+                ('sql_seconds_total', 'Time spent executing SQL.', self.sql_seconds),
+                ('template_seconds_total', 'Time spent rendering templates.', self.template_seconds),
+                ('slow_requests_total', 'Requests slower than SLOW_REQUEST_MS.', self.slow),
+            ):
+                metric(name, 'counter', help_text,
+                       [((('endpoint', endpoint),), round(value, 6)) for endpoint, value in sorted(values.items())])
+        if resource is not None:
+            metric('process_peak_rss_bytes', 'gauge', 'Peak resident memory of this worker process.', [((), _peak_rss())])
+        for name, value in (pool or {}).items():
+            kind = 'counter' if name.endswith('_total') else 'gauge'
+            metric(f'db_pool_{name}', kind, f'Connection pool {name.replace("_", " ")}.', [((), value)])
+        return '\n'.join(lines) + '\n'
+
+def _peak_rss():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _stats():
+    if has_app_context():
+        return g.get('request_stats')
+    return None
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_started'].pop()
+    stats = _stats()
+    if stats is not None:
+        stats.sql_count += 1
+        stats.sql_seconds += seconds
+        stats.queries.append((seconds, statement))
+
+@event.listens_for(Engine, 'handle_error')
+def _query_failed(context):
+    # after_cursor_execute doesn't run for a statement that raised
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started and context.statement is not None:
+        started.pop()
+
+def _template_started(sender, template, context, **extra):
+    stats = _stats()
+    if stats is not None:
+        # Templates rendered inside another (e.g. event cards) are already in the outer one's time
+        if stats.template_depth == 0:
+            stats.template_started = time.perf_counter()
+        stats.template_depth += 1
+
+def _template_finished(sender, template, context, **extra):
+    stats = _stats()
+    if stats is not None and stats.template_depth:
+        stats.template_depth -= 1
+        if stats.template_depth == 0:
+            stats.template_seconds += time.perf_counter() - stats.template_started
+
+def _before_request():
+    g.request_stats = RequestStats()
+    if current_app.config['INSTRUMENT_TRACEMALLOC']:
+        tracemalloc.reset_peak()
+
+def _after_request(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    seconds = time.perf_counter() - stats.started
+    endpoint = request.endpoint or 'unknown'
+    slow = seconds * 1000 >= current_app.config['SLOW_REQUEST_MS']
+    current_app.extensions['metrics'].record(endpoint, request.method, response.status_code, seconds, stats, slow)
+    if slow:
+        memory = ''
+        if tracemalloc.is_tracing():
+            # Python heap peak since this request started (other threads' requests included)
+            memory = f', python peak {tracemalloc.get_traced_memory()[1] // 1024} KB'
+        worst = sorted(stats.queries, key=lambda query: query[0], reverse=True)[:3]
+        # The route, not the path, which can hold secrets such as the calendar feed token
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        current_app.logger.warning(
+            'Slow request %s %s (%s) %.0fms: %d queries in %.0fms, templates %.0fms%s%s',
+            request.method, route, endpoint, seconds * 1000,
+            stats.sql_count, stats.sql_seconds * 1000, stats.template_seconds * 1000, memory,
+            ''.join(f'\n  {query_seconds * 1000:.1f}ms {" ".join(statement.split())[:300]}'
+                    for query_seconds, statement in worst)
+        )
+    return response
+
+def metrics_view():
+    allowed = current_app.config['METRICS_ALLOWED_IPS']
+    if request.remote_addr not in allowed:
+        abort(404)
+    from the_greenhouse import db
+    from the_greenhouse.db_pool import pool_stats
+    body = current_app.extensions['metrics'].render(pool_stats(db.engine))
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+def init_app(app):
+    if not app.config['INSTRUMENTATION']:
+        return
+    app.extensions['metrics'] = Metrics()
+    if app.config['INSTRUMENT_TRACEMALLOC'] and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,181 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+class MemoryJobStore:
+    """Job records kept in this process. Status polls must reach the same worker."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def create(self, job):
+        with self.lock:
+            self.jobs[job['id']] = dict(job)
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(fields, updated_at=time.time())
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def prune(self, older_than):
+        with self.lock:
+            for job_id in [j for j, job in self.jobs.items() if job['updated_at'] < older_than]:
+                del self.jobs[job_id]
+
+class SqliteJobStore:
+    """Job records in a SQLite file, shared by every gunicorn worker on the machine."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, '
+                'context TEXT, result TEXT, error TEXT, '
+                'created_at REAL NOT NULL, updated_at REAL NOT NULL)'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def create(self, job):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, kind, status, context, result, error, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job['id'], job['kind'], job['status'], json.dumps(job['context']),
+                 json.dumps(job['result']), job['error'], job['created_at'], job['updated_at'])
+            )
+
+    def update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        for key in ('context', 'result'):
+            if key in fields:
+                fields[key] = json.dumps(fields[key])
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        with self._connect() as conn:
+            conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['context'] = json.loads(job['context'])
+        job['result'] = json.loads(job['result'])
+        return job
+
+    def prune(self, older_than):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM jobs WHERE updated_at < ?', (older_than,))
+
+class JobQueue:
+    """Runs CPU heavy work off the request worker and records its status.
+
+    JOBS_EXECUTOR picks where jobs run: 'process' (a process pool of
+    JOBS_WORKERS, the default), 'thread', or 'inline' to run them inside the
+    request (useful for local development and tests). JOBS_STORE is 'memory'
+    or 'sqlite' (at JOBS_SQLITE_PATH) for the job status records.
+
+    Completion handlers registered with @jobs.handler(kind) run in the web
+    process inside an app context, so they can update the database.
+    """
+
+    def __init__(self, app = None):
+        self.handlers = {}
+        self.executor = None
+        self.store = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config['JOBS_EXECUTOR']
+        self.workers = app.config['JOBS_WORKERS']
+        self.retention = app.config['JOBS_RETENTION']
+        if app.config['JOBS_STORE'] == 'sqlite':
+            self.store = SqliteJobStore(app.config['JOBS_SQLITE_PATH'])
+        else:
+            self.store = MemoryJobStore()
+        app.extensions['jobs'] = self
+
+    def handler(self, kind):
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    def _executor(self):
+        # Created on first use so each gunicorn worker gets its own pool after forking
+        with self.lock:
+            if self.executor is None:
+                if self.mode == 'thread':
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers)
+                else:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self.executor
+
+    def submit(self, kind, func, *args, context = None):
+        """Queue func(*args) and return the job id.
+
+        func must be a module level function when using the process pool.
+        context is stored with the job (JSON serialisable) and passed to the
+        completion handler along with func's return value.
+        """
+        now = time.time()
+        job = {'id': uuid.uuid4().hex, 'kind': kind, 'status': 'queued', 'context': context or {},
+               'result': None, 'error': None, 'created_at': now, 'updated_at': now}
+        self.store.create(job)
+        self.store.prune(now - self.retention)
+
+        if self.mode == 'inline':
+            try:
+                result = func(*args)
+            except Exception as exc:
+                self._failed(job, exc)
+            else:
+                self._finished(job, result)
+            return job['id']
+
+        future = self._executor().submit(func, *args)
+        future.add_done_callback(lambda future: self._done(job, future))
+        return job['id']
+
+    def _done(self, job, future):
+        exc = future.exception()
+        with self.app.app_context():
+            if exc is not None:
+                self._failed(job, exc)
+            else:
+                self._finished(job, future.result())
+
+    def _finished(self, job, result):
+        try:
+            handler = self.handlers.get(job['kind'])
+            if handler is not None:
+                handler(job['context'], result)
+        except Exception as exc:
+            self._failed(job, exc)
+        else:
+            self.store.update(job['id'], status='done', result=result)
+
+    def _failed(self, job, exc):
+        self.app.logger.exception('Job %s (%s) failed', job['id'], job['kind'], exc_info=exc)
+        self.store.update(job['id'], status='failed', error=str(exc))
+
+    def status(self, job_id):
+        return self.store.get(job_id)
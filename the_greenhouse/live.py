@@ -0,0 +1,263 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+class Subscription(queue.Queue):
+    """Messages for one open stream. overflowed is set when the stream fell too far behind."""
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.overflowed = False
+
+class MemoryBroker:
+    """Publish/subscribe between requests of this process.
+
+    Only streams in the worker that handled the write see it, so it suits a
+    single worker (or the development server). Messages are (id, kind, data)
+    with data already JSON encoded; the last `backlog` per event are kept so
+    a reconnecting stream can catch up.
+    """
+
+    def __init__(self, backlog = 50, max_events = 1024):
+        self.backlog = backlog
+        self.max_events = max_events
+        self.subscribers = {}  # event_id -> set of Subscriptions
+        self.recent = OrderedDict()  # event_id -> deque of recent messages
+        self.lock = threading.Lock()
+        self.token = uuid.uuid4().hex[:8]
+        self.sequence = 0
+
+    def publish(self, event_id, kind, data):
+        with self.lock:
+            self.sequence += 1
+            message = (f'{self.token}-{self.sequence}', kind, data)
+            recent = self.recent.pop(event_id, None) or deque(maxlen=self.backlog)
+            recent.append(message)
+            self.recent[event_id] = recent
+            while len(self.recent) > self.max_events:
+                self.recent.popitem(last=False)
+        self._fan_out(event_id, message)
+
+    def _fan_out(self, event_id, message):
+        with self.lock:
+            subscriptions = list(self.subscribers.get(event_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.put_nowait(message)
+            except queue.Full:
+                subscription.overflowed = True
+
+    def subscribe(self, event_id, maxsize):
+        subscription = Subscription(maxsize)
+        with self.lock:
+            self.subscribers.setdefault(event_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, event_id, subscription):
+        with self.lock:
+            subscriptions = self.subscribers.get(event_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscribers[event_id]
+
+    def current_id(self, event_id):
+        """Id of the last message for event_id, for a page to replay from."""
+        with self.lock:
+            recent = self.recent.get(event_id)
+            return recent[-1][0] if recent else f'{self.token}-0'
+
+    def since(self, event_id, last_id):
+        """Messages for event_id after last_id, or None if some may have been missed."""
+        token, _, sequence = last_id.partition('-')
+        if token != self.token or not sequence.isdigit():
+            # Published by another process (or before a restart)
+            return None
+        sequence = int(sequence)
+        with self.lock:
+            recent = list(self.recent.get(event_id, ()))
+        if len(recent) == self.backlog and int(recent[0][0].split('-')[1]) > sequence + 1:
+            return None
+        return [message for message in recent if int(message[0].split('-')[1]) > sequence]
+
+class SqliteBroker(MemoryBroker):
+    """Messages go through a SQLite file, so every gunicorn worker on the machine sees every write.
+
+    Each process polls the file from one background thread, started by its
+    first stream, and fans the new rows out to its own streams. Idle streams
+    cost nothing beyond that one query per poll interval.
+    """
+
+    def __init__(self, path, poll_interval = 1.0, retention = 300):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.poller = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS live_messages ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, event_id INTEGER NOT NULL, '
+                'kind TEXT NOT NULL, data TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_live_messages_event_id ON live_messages (event_id, id)')
+            # Newest message id pruned per event, so a replay knows whether it is missing anything
+            conn.execute('CREATE TABLE IF NOT EXISTS live_pruned (event_id INTEGER PRIMARY KEY, last_id INTEGER NOT NULL)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def publish(self, event_id, kind, data):
+        with self._connect() as conn:
+            conn.execute('INSERT INTO live_messages (event_id, kind, data, created_at) VALUES (?, ?, ?, ?)',
+                         (event_id, kind, data, time.time()))
+
+    def subscribe(self, event_id, maxsize):
+        with self.lock:
+            # Started here rather than at import so it runs in the gunicorn worker, not the master
+            if self.poller is None:
+                self.poller = threading.Thread(target=self._poll, name='live-poller', daemon=True)
+                self.poller.start()
+        return super().subscribe(event_id, maxsize)
+
+    def _poll(self):
+        conn = self._connect()
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM live_messages').fetchone()[0]
+        pruned_at = 0
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                rows = conn.execute('SELECT id, event_id, kind, data FROM live_messages WHERE id > ? ORDER BY id',
+                                    (last_id,)).fetchall()
+                for message_id, event_id, kind, data in rows:
+                    self._fan_out(event_id, (str(message_id), kind, data))
+                    last_id = message_id
+                if time.monotonic() - pruned_at > 60:
+                    self._prune(conn, time.time() - self.retention)
+                    pruned_at = time.monotonic()
+            except sqlite3.Error:
+                # Locked or briefly unavailable, the next poll picks up from last_id
+                continue
+
+    def _prune(self, conn, before):
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO live_pruned (event_id, last_id) '
+                         'SELECT event_id, MAX(id) FROM live_messages WHERE created_at < ? GROUP BY event_id', (before,))
+            conn.execute('DELETE FROM live_messages WHERE created_at < ?', (before,))
+
+    def current_id(self, event_id):
+        with self._connect() as conn:
+            last_id = conn.execute(
+                'SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM live_messages WHERE event_id = ? '
+                'UNION ALL SELECT last_id FROM live_pruned WHERE event_id = ?)', (event_id, event_id)
+            ).fetchone()[0]
+        return str(last_id or 0)
+
+    def since(self, event_id, last_id):
+        if not last_id.isdigit():
+            return None
+        with self._connect() as conn:
+            pruned = conn.execute('SELECT last_id FROM live_pruned WHERE event_id = ?', (event_id,)).fetchone()
+            if pruned is not None and int(last_id) < pruned[0]:
+                return None
+            rows = conn.execute('SELECT id, kind, data FROM live_messages WHERE event_id = ? AND id > ? ORDER BY id',
+                                (event_id, int(last_id))).fetchall()
+        return [(str(message_id), kind, data) for message_id, kind, data in rows]
+
+def _format(message):
+    message_id, kind, data = message
+    head = f'id: {message_id}\n' if message_id else ''
+    return f'{head}event: {kind}\ndata: {data}\n\n'
+
+class LiveUpdates:
+    """Server-Sent Event streams of changes to a page, one channel per event.
+
+    LIVE_BROKER is 'sqlite' (at LIVE_SQLITE_PATH, shared by the workers on a
+    machine, the default) or 'memory' (this process only). At most
+    LIVE_MAX_CONNECTIONS streams are open per process; each gets a comment
+    every LIVE_HEARTBEAT seconds so proxies keep it open and dead clients are
+    noticed, and is closed after LIVE_MAX_SECONDS for the browser to reconnect.
+    Pages turned away at the limit poll since() every LIVE_FALLBACK_INTERVAL
+    seconds instead, which holds no thread between polls.
+    """
+
+    def __init__(self, app = None):
+        self.broker = None
+        self.connections = 0
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['LIVE_UPDATES']
+        self.max_connections = config['LIVE_MAX_CONNECTIONS']
+        self.heartbeat = config['LIVE_HEARTBEAT']
+        self.max_seconds = config['LIVE_MAX_SECONDS']
+        self.queue_size = config['LIVE_QUEUE_SIZE']
+        if config['LIVE_BROKER'] == 'sqlite':
+            self.broker = SqliteBroker(config['LIVE_SQLITE_PATH'], config['LIVE_POLL_INTERVAL'])
+        else:
+            self.broker = MemoryBroker()
+        app.extensions['live'] = self
+
+    def publish(self, event_id, kind, **data):
+        if self.enabled:
+            self.broker.publish(event_id, kind, json.dumps(data))
+
+    def current_id(self, event_id):
+        # Rendered into the page, so its stream starts from what the page already shows
+        return self.broker.current_id(event_id)
+
+    def since(self, event_id, last_id):
+        """[(id, kind, data)] published for event_id after last_id, or None if the page must reload."""
+        return self.broker.since(event_id, last_id or '')
+
+    def open(self, event_id):
+        """Subscribe a new stream to event_id, or None when this process is at its connection limit."""
+        with self.lock:
+            if self.connections >= self.max_connections:
+                return None
+            self.connections += 1
+        return self.broker.subscribe(event_id, self.queue_size)
+
+    def close(self, event_id, subscription):
+        self.broker.unsubscribe(event_id, subscription)
+        with self.lock:
+            self.connections -= 1
+
+    def stream(self, event_id, subscription, last_id = None):
+        """The text/event-stream body: anything missed since last_id, then new messages as they come."""
+        # Browsers wait this long before reconnecting, spread out so a restart isn't a stampede
+        yield f'retry: {5000 + int(uuid.uuid4().int % 5000)}\n\n'
+        replayed = set()
+        if last_id:
+            missed = self.since(event_id, last_id)
+            if missed is None:
+                yield _format(('', 'resync', '{}'))
+                return
+            for message in missed:
+                replayed.add(message[0])
+                yield _format(message)
+        deadline = time.monotonic() + self.max_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                message = subscription.get(timeout=min(self.heartbeat, remaining))
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+            if subscription.overflowed:
+                # Fell behind; the page reloads rather than applying a partial history
+                yield _format(('', 'resync', '{}'))
+                return
+            if message[0] not in replayed:
+                yield _format(message)
@@ -1,11 +1,51 @@
-from the_greenhouse import db, login_manager
-from werkzeug.security import generate_password_hash, check_password_hash
+from the_greenhouse import db, login_manager, cache, hasher
+from flask import current_app
 from flask_login import UserMixin
+from sqlalchemy import select, union_all
+from sqlalchemy.orm import foreign
 from datetime import datetime, timezone
 
+class UserSnapshot(UserMixin):
+    """Read-only copy of the logged in user's profile fields, used as current_user.
+
+    It has no relationships, so templates can't lazily load a user's events by
+    accident, and it compares equal to the User row with the same id. Views
+    that change the user load the row with db.session.get(User, current_user.id).
+    """
+
+    FIELDS = ('id', 'username', 'email', 'profile_image')
+
+    def __init__(self, id, username, email, profile_image):
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'username', username)
+        object.__setattr__(self, 'email', email)
+        object.__setattr__(self, 'profile_image', profile_image)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('UserSnapshot is read-only, load the User row to change it')
+
+    def __repr__(self):
+        return f"Username: {self.username}"
+
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, user_id)
+    # A tampered or stale session cookie can hold anything; treat it as logged out
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    # Cached under the user's tag, so invalidate_user() drops it along with their pages
+    key = f'session-user:{user_id}'
+    fields = cache.get(key)
+    if fields is None:
+        row = db.session.execute(
+            select(*[getattr(User, field) for field in UserSnapshot.FIELDS]).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        fields = tuple(row)
+        cache.set(key, fields, ttl = current_app.config['USER_CACHE_TTL'], tags = [f'user:{user_id}'])
+    return UserSnapshot(*fields)
 
 class User(db.Model, UserMixin):
 
@@ -16,6 +56,8 @@ class User(db.Model, UserMixin):
     email = db.Column(db.String(64), unique = True, index = True)
     username = db.Column(db.String(64), unique = True, index = True)
     password_hash = db.Column(db.String(256))
+    # Bumped on every change to the row; conditional.py builds page versions from it
+    updated_at = db.Column(db.DateTime, nullable = False, default = lambda: datetime.now(timezone.utc), onupdate = lambda: datetime.now(timezone.utc))
 
     events = db.relationship('Events', backref = 'author', lazy = 'select')
     event_attendances = db.relationship('EventAttendee', backref = 'user', lazy = 'select')
@@ -23,12 +65,17 @@ class User(db.Model, UserMixin):
     def __init__(self, email, username, password):
         self.email = email
         self.username = username
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        print(generate_password_hash(password))
-        print(self.password_hash)
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+
+    def upgrade_password(self, password):
+        # Rehash with the configured method after a successful login, returns True if it changed
+        if not hasher.needs_rehash(self.password_hash):
+            return False
+        self.password_hash = hasher.hash(password)
+        return True
     
     def __repr__(self):
         return f"Username: {self.username}"
@@ -36,6 +83,15 @@ class User(db.Model, UserMixin):
 class Events(db.Model):
 
     __tablename__ = 'events'
+    __table_args__ = (
+        # Feed order (newest first, keyset cursor) and a user's own events
+        db.Index('ix_events_created_date_id', 'created_date', 'id'),
+        db.Index('ix_events_user_id_created_date', 'user_id', 'created_date', 'id'),
+        # Upcoming events, date filters and the account calendar
+        db.Index('ix_events_event_date', 'event_date'),
+        # Ids are never handed out twice, even after the newest events are archived (see archive.py)
+        {'sqlite_autoincrement': True},
+    )
 
     id = db.Column(db.Integer, primary_key = True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False)
@@ -46,6 +102,17 @@ class Events(db.Model):
     event_time = db.Column(db.Time, nullable = False)
     location = db.Column(db.String(200), nullable = False)
 
+    # Denormalized counters, kept in step by posts.counters in the same transaction as the write
+    attendee_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    definitely_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    possibly_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    maybe_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    buying_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    selling_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    both_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    item_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
+    updated_at = db.Column(db.DateTime, nullable = False, default = lambda: datetime.now(timezone.utc), onupdate = lambda: datetime.now(timezone.utc))
+
     def __init__(self, event_title, event_description, event_date, event_time, location, user_id):
         self.event_title = event_title
         self.event_description = event_description
@@ -63,6 +130,12 @@ class Events(db.Model):
 class EventAttendee(db.Model):
     
     __tablename__ = 'event_attendees'
+    __table_args__ = (
+        # A user attends an event at most once; also serves the attendance checks and loading by event
+        db.Index('uq_event_attendees_event_id_user_id', 'event_id', 'user_id', unique = True),
+        # Events a user is attending (account calendar)
+        db.Index('ix_event_attendees_user_id_event_id', 'user_id', 'event_id'),
+    )
     
     id = db.Column(db.Integer, primary_key = True)
     event_id = db.Column(db.Integer, db.ForeignKey('events.id'), nullable = False)
@@ -71,6 +144,7 @@ class EventAttendee(db.Model):
     purpose = db.Column(db.String(20), nullable = False)  # 'Buy', 'Sell', 'Both'
     items_bringing = db.Column(db.Text, nullable = True)  # JSON string of items
     joined_date = db.Column(db.DateTime, nullable = False, default = lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, nullable = False, default = lambda: datetime.now(timezone.utc), onupdate = lambda: datetime.now(timezone.utc))
     
     def __init__(self, event_id, user_id, attendance_likelihood, purpose, items_bringing=None):
         self.event_id = event_id
@@ -85,6 +159,9 @@ class EventAttendee(db.Model):
 class EventItem(db.Model):
     
     __tablename__ = 'event_items'
+    __table_args__ = (
+        db.Index('ix_event_items_event_id_user_id', 'event_id', 'user_id'),
+    )
     
     id = db.Column(db.Integer, primary_key = True)
     event_id = db.Column(db.Integer, db.ForeignKey('events.id'), nullable = False)
@@ -101,4 +178,91 @@ class EventItem(db.Model):
         self.item_name = item_name
     
     def __repr__(self):
-        return f"EventItem: {self.item_name} by User {self.user_id} for Event {self.event_id}"
\ No newline at end of file
+        return f"EventItem: {self.item_name} by User {self.user_id} for Event {self.event_id}"
+
+class EventArchive(db.Model):
+    """A past event moved out of events by `flask archive run`, with the same columns.
+
+    The attendees and items go to the matching archive tables at the same
+    time, so the hot tables only hold recent and upcoming events.
+    """
+
+    __tablename__ = 'events_archive'
+    __table_args__ = (
+        db.Index('ix_events_archive_user_id_created_date', 'user_id', 'created_date'),
+    )
+
+    id = db.Column(db.Integer, primary_key = True, autoincrement = False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False)
+    created_date = db.Column(db.DateTime, nullable = False)
+    event_title = db.Column(db.String(140), nullable = False)
+    event_description = db.Column(db.Text, nullable = False)
+    event_date = db.Column(db.Date, nullable = False)
+    event_time = db.Column(db.Time, nullable = False)
+    location = db.Column(db.String(200), nullable = False)
+    attendee_count = db.Column(db.Integer, nullable = False, default = 0)
+    definitely_count = db.Column(db.Integer, nullable = False, default = 0)
+    possibly_count = db.Column(db.Integer, nullable = False, default = 0)
+    maybe_count = db.Column(db.Integer, nullable = False, default = 0)
+    buying_count = db.Column(db.Integer, nullable = False, default = 0)
+    selling_count = db.Column(db.Integer, nullable = False, default = 0)
+    both_count = db.Column(db.Integer, nullable = False, default = 0)
+    item_count = db.Column(db.Integer, nullable = False, default = 0)
+    updated_at = db.Column(db.DateTime, nullable = False)
+    archived_date = db.Column(db.DateTime, nullable = False, default = lambda: datetime.now(timezone.utc))
+
+    author = db.relationship('User', lazy = 'select')
+    attendees = db.relationship('EventAttendeeArchive', backref = 'event', lazy = 'select', cascade = 'all, delete-orphan')
+    event_items = db.relationship('EventItemArchive', backref = 'event', lazy = 'select', cascade = 'all, delete-orphan')
+
+    def __repr__(self):
+        return f"Archived Event ID: {self.id} -- Title: {self.event_title} -- Date: {self.event_date}"
+
+class EventAttendeeArchive(db.Model):
+
+    __tablename__ = 'event_attendees_archive'
+    __table_args__ = (
+        db.Index('ix_event_attendees_archive_event_id', 'event_id'),
+        # Archived events a user attended (account calendar)
+        db.Index('ix_event_attendees_archive_user_id_event_id', 'user_id', 'event_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key = True)
+    event_id = db.Column(db.Integer, db.ForeignKey('events_archive.id'), nullable = False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False)
+    attendance_likelihood = db.Column(db.String(20), nullable = False)
+    purpose = db.Column(db.String(20), nullable = False)
+    items_bringing = db.Column(db.Text, nullable = True)
+    joined_date = db.Column(db.DateTime, nullable = False)
+    updated_at = db.Column(db.DateTime, nullable = False)
+
+    user = db.relationship('User', lazy = 'select')
+
+class EventItemArchive(db.Model):
+
+    __tablename__ = 'event_items_archive'
+    __table_args__ = (
+        db.Index('ix_event_items_archive_event_id_user_id', 'event_id', 'user_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key = True)
+    event_id = db.Column(db.Integer, db.ForeignKey('events_archive.id'), nullable = False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False)
+    item_name = db.Column(db.String(200), nullable = False)
+    added_date = db.Column(db.DateTime, nullable = False)
+
+    user = db.relationship('User', lazy = 'select')
+
+# Hot and archived events as one read-only union, for pages that list past events too
+all_events = union_all(
+    select(*Events.__table__.c),
+    select(*[EventArchive.__table__.c[column.name] for column in Events.__table__.c]),
+).subquery('all_events')
+
+class AnyEvent(db.Model):
+    """An event from either events or events_archive, with the same attributes as Events."""
+
+    __table__ = all_events
+    __mapper_args__ = {'primary_key': [all_events.c.id]}
+
+    author = db.relationship('User', primaryjoin = lambda: foreign(all_events.c.user_id) == User.id, lazy = 'select', viewonly = True)
@@ -0,0 +1,115 @@
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, asc, desc, func, or_, select
+from the_greenhouse import db
+
+class KeysetPage:
+    """One page of a cursor paginated query.
+
+    Exposes the same items/has_next/has_prev/total attributes templates use
+    on db.paginate results, with opaque next_cursor/prev_cursor tokens in
+    place of page numbers.
+    """
+    mode = 'keyset'
+
+    def __init__(self, items, per_page, next_cursor, prev_cursor, total):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt = 'keyset-cursor')
+
+def _encode(row, columns, direction):
+    values = []
+    for column in columns:
+        value = getattr(row, column.key)
+        values.append(value.isoformat() if isinstance(value, datetime) else value)
+    return _serializer().dumps([direction] + values)
+
+def _decode(cursor, columns):
+    # Tampered or stale tokens just start again from the first page
+    try:
+        direction, *values = _serializer().loads(cursor)
+    except (BadSignature, ValueError, TypeError):
+        return None, None
+    if direction not in ('next', 'prev') or len(values) != len(columns):
+        return None, None
+    try:
+        values = [datetime.fromisoformat(value) if column.type.python_type is datetime else value
+                  for column, value in zip(columns, values)]
+    except (ValueError, TypeError):
+        return None, None
+    return direction, values
+
+_count_cache = {}
+_count_lock = threading.Lock()
+
+def cached_total(query, ttl):
+    """COUNT(*) of a query, reused for ttl seconds per distinct statement and parameters."""
+    compiled = query.compile(db.engine)
+    key = (str(compiled), tuple(sorted((name, repr(value)) for name, value in compiled.params.items())))
+    now = time.monotonic()
+    with _count_lock:
+        hit = _count_cache.get(key)
+        if hit is not None and hit[1] > now:
+            return hit[0]
+    total = db.session.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
+    with _count_lock:
+        # Keep the cache bounded, expired entries first
+        if len(_count_cache) >= 1024:
+            for stale in [k for k, (_, expires) in _count_cache.items() if expires <= now] or list(_count_cache)[:256]:
+                del _count_cache[stale]
+        _count_cache[key] = (total, now + ttl)
+    return total
+
+def keyset_paginate(query, columns, cursor = None, per_page = 10, total = 'cached'):
+    """Paginate query newest first on columns (e.g. created_date, id) without OFFSET.
+
+    total is 'exact' for a COUNT on every call, 'cached' to reuse a recent count
+    for PAGINATION_COUNT_TTL seconds, or None to skip counting.
+    """
+    direction, values = _decode(cursor, columns) if cursor else (None, None)
+    base = query
+
+    if values is not None:
+        # Row-value comparison written out so it works on every backend we support
+        compare = (lambda column, value: column < value) if direction == 'next' else (lambda column, value: column > value)
+        conditions = []
+        for position, (column, value) in enumerate(zip(columns, values)):
+            equal = [c == v for c, v in zip(columns[:position], values[:position])]
+            conditions.append(and_(*equal, compare(column, value)))
+        query = query.where(or_(*conditions))
+
+    order = asc if direction == 'prev' else desc
+    rows = db.session.scalars(query.order_by(*[order(column) for column in columns]).limit(per_page + 1)).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == 'prev':
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if (direction == 'prev') or more:
+            next_cursor = _encode(rows[-1], columns, 'next')
+        if (direction == 'next') or (direction == 'prev' and more):
+            prev_cursor = _encode(rows[0], columns, 'prev')
+
+    if total == 'exact':
+        total = db.session.scalar(select(func.count()).select_from(base.order_by(None).subquery()))
+    elif total == 'cached':
+        total = cached_total(base, current_app.config['PAGINATION_COUNT_TTL'])
+    return KeysetPage(rows, per_page, next_cursor, prev_cursor, total)
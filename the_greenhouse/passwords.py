@@ -0,0 +1,160 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+
+import click
+from flask.cli import AppGroup
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash
+
+class HasherBusy(ServiceUnavailable):
+    description = 'Too many sign-ins are being processed right now, please try again in a moment.'
+
+def hash_method(password_hash):
+    # Werkzeug hashes are stored as 'method$salt$hash', e.g. 'scrypt:32768:8:1$...'
+    return password_hash.split('$', 1)[0]
+
+def _expanded_method(method):
+    # Werkzeug fills in defaults when hashing, so 'pbkdf2:sha256' is stored as
+    # 'pbkdf2:sha256:1000000' and only a real hash shows the stored form
+    return hash_method(generate_password_hash('probe', method))
+
+class PasswordHasher:
+    """Runs password hashing on a small pool so it can't tie up every request worker.
+
+    PASSWORD_HASH_EXECUTOR is 'thread' (default; hashlib releases the GIL
+    while hashing), 'process' or 'inline'. At most PASSWORD_HASH_WORKERS hashes
+    run at once with up to PASSWORD_HASH_QUEUE more waiting; past that, or when
+    a hash waits longer than PASSWORD_HASH_TIMEOUT seconds, HasherBusy (a 503)
+    is raised instead of holding the worker. New hashes use
+    PASSWORD_HASH_METHOD and older ones are upgraded on the next login.
+    """
+
+    def __init__(self, app = None):
+        self.executor = None
+        self.stored_method = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.stored_method = None
+        self.mode = app.config['PASSWORD_HASH_EXECUTOR']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self.slots = threading.BoundedSemaphore(self.workers + app.config['PASSWORD_HASH_QUEUE'])
+        app.extensions['passwords'] = self
+        app.cli.add_command(passwords_cli)
+
+    def _executor(self):
+        # Created on first use so each gunicorn worker gets its own pool after forking
+        with self.lock:
+            if self.executor is None:
+                if self.mode == 'process':
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers)
+                else:
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hasher')
+            return self.executor
+
+    def _run(self, func, *args):
+        if self.mode == 'inline':
+            return func(*args)
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._executor().submit(func, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        # The slot is held until the hash has actually finished (or was cancelled before starting),
+        # so hashes the request gave up on still count against the bound
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HasherBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        if self.stored_method is None:
+            # Worked out on first use rather than in init_app so CLI commands don't pay for a hash
+            self.stored_method = self._run(_expanded_method, self.method)
+        return hash_method(password_hash) != self.stored_method
+
+passwords_cli = AppGroup('passwords', help='Password hashing tools.')
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+@passwords_cli.command('bench')
+@click.option('--logins', default=200, show_default=True, help='Password checks to run.')
+@click.option('--concurrency', default=16, show_default=True, help='Simultaneous login attempts.')
+@click.option('--page', default='/', show_default=True, help='Page fetched alongside the logins to measure render latency.')
+def bench_command(logins, concurrency, page):
+    """Measure login throughput and page latency during a login spike."""
+    from flask import current_app
+    from the_greenhouse import hasher
+
+    app = current_app._get_current_object()
+    client = app.test_client()
+    password_hash = hasher.hash('benchmark-password')
+
+    def page_latencies(stop):
+        samples = []
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.get(page)
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    # Page latency with no logins running, for comparison
+    idle = []
+    for _ in range(20):
+        started = time.perf_counter()
+        client.get(page)
+        idle.append(time.perf_counter() - started)
+
+    results = {'ok': 0, 'busy': 0}
+    results_lock = threading.Lock()
+    remaining = iter(range(logins))
+
+    def login_worker():
+        for _ in remaining:
+            try:
+                hasher.verify(password_hash, 'benchmark-password')
+                outcome = 'ok'
+            except HasherBusy:
+                outcome = 'busy'
+            with results_lock:
+                results[outcome] += 1
+
+    stop = threading.Event()
+    loaded = []
+    page_thread = threading.Thread(target=lambda: loaded.extend(page_latencies(stop)))
+    page_thread.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=login_worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    page_thread.join()
+
+    click.echo(f'method={hasher.method} executor={hasher.mode} workers={hasher.workers}')
+    click.echo(f"logins: {results['ok']} ok, {results['busy']} rejected as busy, "
+               f"{results['ok'] / elapsed:.1f}/s over {elapsed:.2f}s")
+    for label, samples in (('idle', idle), ('during logins', loaded)):
+        if samples:
+            click.echo(f'{page} {label}: p50={statistics.median(samples) * 1000:.1f}ms '
+                       f'p95={_percentile(samples, 95) * 1000:.1f}ms ({len(samples)} requests)')
@@ -0,0 +1,48 @@
+from flask import render_template
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from the_greenhouse import db, live
+from the_greenhouse.models import Events, EventAttendee, EventItem
+
+# Messages for the live event page (templates/event.html). Call them after the
+# commit, so streams in other workers never see a change that was rolled back.
+
+def publish_attendee(event_id, user_id):
+    """Send user_id's attendee card and items on event_id's page, or their removal, with the new totals."""
+    if not live.enabled:
+        return
+    event = db.session.get(Events, event_id)
+    if event is None:
+        return
+    attendee = db.session.scalar(
+        select(EventAttendee).options(joinedload(EventAttendee.user))
+        .where(EventAttendee.event_id == event_id, EventAttendee.user_id == user_id)
+    )
+    items = db.session.scalars(
+        select(EventItem).options(joinedload(EventItem.user))
+        .where(EventItem.event_id == event_id, EventItem.user_id == user_id)
+        .order_by(EventItem.id)
+    ).all()
+    live.publish(
+        event_id, 'attendee',
+        user_id = user_id,
+        attendee = render_template('event_attendee.html', attendee=attendee, event=event) if attendee else None,
+        items = [render_template('event_item.html', item=item) for item in items],
+        attendee_count = event.attendee_count,
+        item_count = event.item_count,
+    )
+
+def publish_details(event):
+    # Formatted as event.html shows them
+    live.publish(
+        event.id, 'details',
+        title = event.event_title,
+        description = event.event_description,
+        date = event.event_date.strftime('%B %d, %Y'),
+        time = event.event_time.strftime('%I:%M %p'),
+        location = event.location,
+        maps_url = 'https://www.google.com/maps/search/' + '+'.join(event.location.split(' ')),
+    )
+
+def publish_deleted(event_id):
+    live.publish(event_id, 'deleted')
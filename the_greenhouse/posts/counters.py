@@ -0,0 +1,102 @@
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, func, or_, select, update
+from the_greenhouse import db
+from the_greenhouse.models import Events, EventAttendee, EventItem
+
+LIKELIHOOD_COUNTERS = {'Definitely': 'definitely_count', 'Possibly': 'possibly_count', 'Maybe': 'maybe_count'}
+PURPOSE_COUNTERS = {'Buy': 'buying_count', 'Sell': 'selling_count', 'Both': 'both_count'}
+
+counters_cli = AppGroup('counters', help='Maintain the per-event attendee and item counters.')
+
+def attendee_deltas(likelihood, purpose, sign = 1):
+    # Counter changes for one attendee joining (sign = 1) or leaving (sign = -1)
+    deltas = {'attendee_count': sign}
+    if likelihood in LIKELIHOOD_COUNTERS:
+        deltas[LIKELIHOOD_COUNTERS[likelihood]] = sign
+    if purpose in PURPOSE_COUNTERS:
+        deltas[PURPOSE_COUNTERS[purpose]] = deltas.get(PURPOSE_COUNTERS[purpose], 0) + sign
+    return deltas
+
+def item_deltas(count):
+    return {'item_count': count}
+
+def _merge(deltas):
+    merged = {}
+    for delta in deltas:
+        for column, value in delta.items():
+            merged[column] = merged.get(column, 0) + value
+    return {column: value for column, value in merged.items() if value}
+
+def apply_counters(event, *deltas):
+    """Apply counter changes to event in the current transaction.
+
+    Events already in the database get a single UPDATE ... SET x = x + n so
+    concurrent joins can't lose each other's increments, and whose
+    updated_at moves with it (the event page's version); pending events just
+    have their attributes set before they are inserted.
+    """
+    merged = _merge(deltas)
+    if not merged:
+        return
+    if event.id is None:
+        for column, value in merged.items():
+            setattr(event, column, (getattr(event, column) or 0) + value)
+        return
+    db.session.execute(
+        update(Events)
+        .where(Events.id == event.id)
+        .values({getattr(Events, column): getattr(Events, column) + value for column, value in merged.items()})
+        .execution_options(synchronize_session = False)
+    )
+    # The loaded object no longer matches the row
+    db.session.expire(event, list(merged))
+
+def _actual_counts():
+    # Column -> correlated COUNT(*) subquery giving the true value for each event
+    def attendees(*conditions):
+        return (select(func.count()).select_from(EventAttendee)
+                .where(EventAttendee.event_id == Events.id, *conditions).scalar_subquery())
+    actual = {'attendee_count': attendees()}
+    for likelihood, column in LIKELIHOOD_COUNTERS.items():
+        actual[column] = attendees(EventAttendee.attendance_likelihood == likelihood)
+    for purpose, column in PURPOSE_COUNTERS.items():
+        actual[column] = attendees(EventAttendee.purpose == purpose)
+    actual['item_count'] = (select(func.count()).select_from(EventItem)
+                            .where(EventItem.event_id == Events.id).scalar_subquery())
+    return actual
+
+def rebuild_counters(batch_size = 1000, dry_run = False):
+    """Recompute every event's counters, batch_size events per statement.
+
+    Returns (events checked, events whose counters had drifted).
+    """
+    actual = _actual_counts()
+    drifted = or_(*[getattr(Events, column) != value for column, value in actual.items()])
+    checked = fixed = 0
+    last_id = 0
+    while True:
+        ids = db.session.scalars(
+            select(Events.id).where(Events.id > last_id).order_by(Events.id).limit(batch_size)
+        ).all()
+        if not ids:
+            break
+        batch = and_(Events.id >= ids[0], Events.id <= ids[-1])
+        checked += len(ids)
+        fixed += db.session.scalar(select(func.count()).select_from(Events).where(batch, drifted))
+        if not dry_run:
+            db.session.execute(update(Events).where(batch).values(actual).execution_options(synchronize_session = False))
+            db.session.commit()
+        last_id = ids[-1]
+    return checked, fixed
+
+@counters_cli.command('rebuild')
+@click.option('--batch-size', default = 1000, show_default = True, help = 'Events updated per statement.')
+@click.option('--dry-run', is_flag = True, help = 'Only report how many events have drifted.')
+def rebuild_command(batch_size, dry_run):
+    """Recompute attendee and item counters from the attendees and items tables."""
+    checked, fixed = rebuild_counters(batch_size, dry_run)
+    click.echo(f"Checked {checked} events, {fixed} {'would be' if dry_run else 'were'} corrected.")
+
+def init_app(app):
+    app.cli.add_command(counters_cli)
@@ -0,0 +1,70 @@
+from collections import Counter
+from datetime import datetime, timezone
+
+from sqlalchemy import select, insert, delete, and_
+from the_greenhouse import db
+from the_greenhouse.models import Events, EventItem
+from the_greenhouse.core import search
+from the_greenhouse.conditional import touch_events
+
+def parse_items(items_bringing):
+    # One item per non-blank line of the items_bringing text
+    if not items_bringing:
+        return []
+    return [item.strip() for item in items_bringing.split('\n') if item.strip()]
+
+def sync_items(event, user_id, items_bringing, existing = None):
+    """Make user_id's EventItem rows for event match the items_bringing text.
+
+    Only the difference is written: rows for removed lines go in one DELETE
+    and new lines in one multi-row INSERT. A pending event is flushed first so
+    the rows can reference it. existing can be passed as [] when the user is
+    known to have no items yet (e.g. just joined), which skips the lookup.
+
+    Returns the change in the number of items, for the event counters.
+    """
+    wanted = Counter(parse_items(items_bringing))
+
+    if event.id is None:
+        # The event's id is needed before its items can reference it
+        db.session.flush()
+
+    mine = and_(EventItem.event_id == event.id, EventItem.user_id == user_id)
+
+    # Dropping every item needs no lookup
+    if not wanted and existing is None:
+        removed = db.session.execute(delete(EventItem).where(mine).execution_options(synchronize_session = False)).rowcount
+        if removed:
+            search.mark_dirty(db.session, [event.id])
+            touch_events(Events.id == event.id)
+        return -removed
+
+    if existing is None:
+        existing = db.session.execute(select(EventItem.id, EventItem.item_name).where(mine)).all()
+
+    # Keep as many existing rows of each name as are still wanted
+    remaining = Counter(wanted)
+    stale_ids = []
+    for item_id, name in existing:
+        if remaining[name] > 0:
+            remaining[name] -= 1
+        else:
+            stale_ids.append(item_id)
+
+    now = datetime.now(timezone.utc)
+    new_rows = [
+        {'event_id': event.id, 'user_id': user_id, 'item_name': name, 'added_date': now}
+        for name, count in remaining.items() for _ in range(count)
+    ]
+
+    if stale_ids:
+        db.session.execute(
+            delete(EventItem).where(EventItem.id.in_(stale_ids)).execution_options(synchronize_session = False)
+        )
+    if new_rows:
+        db.session.execute(insert(EventItem), new_rows)
+    if stale_ids or new_rows:
+        search.mark_dirty(db.session, [event.id])
+        # Renaming an item leaves the counters alone, so the page version is bumped here
+        touch_events(Events.id == event.id)
+    return len(new_rows) - len(stale_ids)
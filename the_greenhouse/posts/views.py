@@ -1,9 +1,19 @@
-from flask import render_template, url_for, flash, redirect, request, Blueprint, abort
+from flask import render_template, url_for, flash, redirect, request, Blueprint, abort, Response, jsonify
 from flask_login import current_user, login_required
-from the_greenhouse import db
-from the_greenhouse.models import Events, EventAttendee, EventItem
+from the_greenhouse import db, live
+from the_greenhouse.models import Events, EventAttendee, EventArchive
 from the_greenhouse.posts.forms import EventForm, JoinEventForm
+from the_greenhouse.query_profiles import load_profile
+from the_greenhouse.query_budget import query_budget
+from the_greenhouse.replicas import read_only
+from the_greenhouse.conditional import conditional, event_version
+from the_greenhouse.core.feed_cache import invalidate_event
+from the_greenhouse.users.calendar_data import invalidate_calendars
+from the_greenhouse.posts.counters import apply_counters, attendee_deltas, item_deltas
+from the_greenhouse.posts.items import parse_items, sync_items
+from the_greenhouse.posts.broadcast import publish_attendee, publish_details, publish_deleted
 from sqlalchemy import select, and_
+from sqlalchemy.exc import IntegrityError
 from datetime import date
 
 posts = Blueprint('posts', __name__)
@@ -22,73 +32,73 @@ def create_event():
             user_id = current_user.id
         )
         db.session.add(event)
-        db.session.flush()  # Get the event ID
         
         # Automatically join the creator to the event
         items_bringing = None
         if form.purpose.data in ['Sell', 'Both'] and form.items_bringing.data:
             items_bringing = form.items_bringing.data
         
-        attendee = EventAttendee(
-            event_id=event.id,
+        # Counters are set on the new event before it is inserted
+        apply_counters(event, attendee_deltas('Definitely', form.purpose.data), item_deltas(len(parse_items(items_bringing))))
+        
+        event.attendees.append(EventAttendee(
+            event_id=None,
             user_id=current_user.id,
             attendance_likelihood='Definitely',  # Creator is definitely attending
             purpose=form.purpose.data,
             items_bringing=items_bringing
-        )
-        
-        db.session.add(attendee)
-        db.session.flush()  # Get the attendee ID
+        ))
         
-        # Parse items_bringing text and create EventItem records for creator
-        if items_bringing and form.purpose.data in ['Sell', 'Both']:
-            # Split items by newlines and process each item
-            items_list = [item.strip() for item in items_bringing.split('\n') if item.strip()]
-            
-            for item_text in items_list:
-                # Simple item name only
-                item_name = item_text.strip()
-                
-                # Create EventItem record
-                event_item = EventItem(
-                    event_id=event.id,
-                    user_id=current_user.id,
-                    item_name=item_name
-                )
-                db.session.add(event_item)
+        # Inserts the event and attendee in one flush, then the items in one statement
+        sync_items(event, current_user.id, items_bringing, existing=[])
         
         db.session.commit()
+        invalidate_event(event.id, feed=True)
+        invalidate_calendars(current_user.id)
         flash('Event created successfully and you have been automatically joined!', 'success')
         return redirect(url_for('core.index'))
 
     return render_template('create_event.html', form = form)
 
+def event_page_version(event_id):
+    version = event_version(event_id)
+    if version is None or not live.enabled:
+        return version
+    # The page carries its place in the live stream, a cached copy must carry the current one
+    parts, last_modified = version
+    return (*parts, live.current_id(event_id)), last_modified
+
 @posts.route('/event/<int:event_id>')
+@read_only
+@conditional(event_page_version)
+@query_budget(4)
 def event(event_id):
-    event = db.session.scalar(select(Events).where(Events.id == event_id))
+    # Taken before the page is loaded, so the stream replays anything committed while it renders
+    live_id = live.current_id(event_id) if live.enabled else None
+    
+    # Event, attendees and items with their users in three queries
+    event = db.session.scalar(
+        select(Events).options(*load_profile('event_page')).where(Events.id == event_id)
+    )
+    archived = False
     if event is None:
-        abort(404)
+        # Past events are moved to the archive tables by `flask archive run`
+        event = db.session.scalar(
+            select(EventArchive).options(*load_profile('archived_event_page')).where(EventArchive.id == event_id)
+        )
+        if event is None:
+            abort(404)
+        archived = True
+    
+    attendees = event.attendees
+    event_items = event.event_items
     
     # Check if current user is already attending
     user_attending = None
     if current_user.is_authenticated:
-        user_attending = db.session.scalar(
-            select(EventAttendee).where(
-                and_(EventAttendee.event_id == event_id, EventAttendee.user_id == current_user.id)
-            )
-        )
-    
-    # Get all attendees
-    attendees = db.session.scalars(
-        select(EventAttendee).where(EventAttendee.event_id == event_id)
-    ).all()
+        user_attending = next((attendee for attendee in attendees if attendee.user_id == current_user.id), None)
     
-    # Get all event items
-    event_items = db.session.scalars(
-        select(EventItem).where(EventItem.event_id == event_id)
-    ).all()
-    
-    return render_template('event.html', event=event, user_attending=user_attending, attendees=attendees, event_items=event_items, now = date.today())
+    return render_template('event.html', event=event, user_attending=user_attending, attendees=attendees, event_items=event_items, archived=archived, now = date.today(), live_id = live_id)
 
 @posts.route('/event/<int:event_id>/update', methods = ['GET', 'POST'])
 @login_required
@@ -96,10 +106,11 @@ def update(event_id):
     event = db.session.scalar(select(Events).where(Events.id == event_id))
     if event is None:
         abort(404)
-    if event.author != current_user:
+    if event.user_id != current_user.id:
         abort(403)
     form = EventForm()
     if form.validate_on_submit():
+        old_event_date = event.event_date
         event.event_title = form.event_title.data
         event.event_description = form.event_description.data
         event.event_date = form.event_date.data
@@ -113,14 +124,29 @@ def update(event_id):
             )
         )
         
+        items_changed = False
         if creator_attendance:
-            creator_attendance.purpose = form.purpose.data
             items_bringing = None
             if form.purpose.data in ['Sell', 'Both'] and form.items_bringing.data:
                 items_bringing = form.items_bringing.data
+            items_changed = creator_attendance.items_bringing != items_bringing
+            items_delta = sync_items(event, current_user.id, items_bringing)
+            # Move the creator between the purpose counters
+            apply_counters(event,
+                           attendee_deltas(creator_attendance.attendance_likelihood, creator_attendance.purpose, -1),
+                           attendee_deltas(creator_attendance.attendance_likelihood, form.purpose.data),
+                           item_deltas(items_delta))
+            creator_attendance.purpose = form.purpose.data
             creator_attendance.items_bringing = items_bringing
         
         db.session.commit()
+        # A new date can move the event on or off the unfiltered feed
+        invalidate_event(event.id, feed=event.event_date != old_event_date, search=True, items=items_changed)
+        if event.event_date.year != old_event_date.year:
+            # Calendars are cached per year and the new year's don't carry this event's tag yet
+            invalidate_calendars(*db.session.scalars(select(EventAttendee.user_id).where(EventAttendee.event_id == event.id)))
+        publish_details(event)
+        publish_attendee(event.id, current_user.id)
         flash('Event updated successfully', 'success')
         return redirect(url_for('posts.event', event_id = event.id))
 
@@ -149,12 +175,14 @@ def delete(event_id):
     event = db.session.scalar(select(Events).where(Events.id == event_id))
     if event is None:
         abort(404)
-    if event.author != current_user:
+    if event.user_id != current_user.id:
         abort(403)
     
     # Delete the event (cascade will handle attendees automatically)
     db.session.delete(event)
     db.session.commit()
+    invalidate_event(event_id, feed=True)
+    publish_deleted(event_id)
     flash('Event deleted successfully', 'success')
     return redirect(url_for('core.index'))
 
@@ -191,27 +219,22 @@ def join_event(event_id):
             items_bringing=items_bringing
         )
         
-        db.session.add(attendee)
-        db.session.flush()  # Get the attendee ID
-        
-        # Parse items_bringing text and create EventItem records
-        if items_bringing and form.purpose.data in ['Sell', 'Both']:
-            # Split items by newlines and process each item
-            items_list = [item.strip() for item in items_bringing.split('\n') if item.strip()]
+        try:
+            db.session.add(attendee)
             
-            for item_text in items_list:
-                # Simple item name only
-                item_name = item_text.strip()
-                
-                # Create EventItem record
-                event_item = EventItem(
-                    event_id=event_id,
-                    user_id=current_user.id,
-                    item_name=item_name
-                )
-                db.session.add(event_item)
-        
-        db.session.commit()
+            # A new attendee has no items yet
+            items_added = sync_items(event, current_user.id, items_bringing, existing=[])
+            
+            apply_counters(event, attendee_deltas(attendee.attendance_likelihood, attendee.purpose), item_deltas(items_added))
+            db.session.commit()
+        except IntegrityError:
+            # The same user joined from another tab in the meantime, the unique index keeps one
+            db.session.rollback()
+            flash('You are already attending this event!', 'info')
+            return redirect(url_for('posts.event', event_id=event_id))
+        invalidate_event(event_id, items=bool(items_bringing))
+        invalidate_calendars(current_user.id)
+        publish_attendee(event_id, current_user.id)
         flash('Successfully joined the event!', 'success')
         return redirect(url_for('posts.event', event_id=event_id))
     
@@ -242,13 +265,53 @@ def unattend_event(event_id):
         return redirect(url_for('posts.event', event_id=event_id))
     
     # Delete all EventItem records for this user and event
-    EventItem.query.filter(
-        and_(EventItem.event_id == event_id, EventItem.user_id == current_user.id)
-    ).delete()
+    items_delta = sync_items(event, current_user.id, None)
+    apply_counters(event,
+                   attendee_deltas(user_attendance.attendance_likelihood, user_attendance.purpose, -1),
+                   item_deltas(items_delta))
     
     # Delete the EventAttendee record
+    had_items = bool(user_attendance.items_bringing)
     db.session.delete(user_attendance)
     db.session.commit()
+    invalidate_event(event_id, items=had_items)
+    invalidate_calendars(current_user.id)
+    publish_attendee(event_id, current_user.id)
     
     flash('You have successfully unattended the event. Your items have been removed.', 'success')
-    return redirect(url_for('posts.event', event_id=event_id))
\ No newline at end of file
+    return redirect(url_for('posts.event', event_id=event_id))
+
+@posts.route('/event/<int:event_id>/live')
+@read_only
+def event_live(event_id):
+    """Server-Sent Events for an open event page: attendee, item and detail changes as they are committed."""
+    if not live.enabled:
+        abort(404)
+    # Archived events don't change any more
+    if db.session.scalar(select(Events.id).where(Events.id == event_id)) is None:
+        abort(404)
+    subscription = live.open(event_id)
+    if subscription is None:
+        # At LIVE_MAX_CONNECTIONS; the page polls event_live_since instead
+        return Response('Too many live connections\n', 503, {'Retry-After': '30'}, mimetype='text/plain')
+    # The browser sends Last-Event-ID when it reconnects; the first connection starts from the page's live_id
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    # Not stream_with_context: the stream holds no request context or database connection while it waits
+    response = Response(live.stream(event_id, subscription, last_id), mimetype='text/event-stream')
+    response.call_on_close(lambda: live.close(event_id, subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    # Don't let nginx buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@posts.route('/event/<int:event_id>/live/since')
+def event_live_since(event_id):
+    """The messages after last_id as JSON, polled by pages that were turned away from event_live."""
+    if not live.enabled:
+        abort(404)
+    # Read from the live broker only, so a poll costs no database query or waiting thread
+    missed = live.since(event_id, request.args.get('last_id'))
+    messages = [{'id': message_id, 'kind': kind, 'data': data} for message_id, kind, data in missed or ()]
+    response = jsonify(messages = messages, resync = missed is None)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,55 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_active = threading.local()
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_active, 'counters', ()):
+        counter.count += 1
+        counter.statements.append(statement)
+
+@contextmanager
+def count_queries():
+    """Count the SQL statements executed on this thread inside the block."""
+    counter = QueryCounter()
+    if not hasattr(_active, 'counters'):
+        _active.counters = []
+    _active.counters.append(counter)
+    try:
+        yield counter
+    finally:
+        _active.counters.remove(counter)
+
+def query_budget(limit):
+    """Declare the maximum number of queries a view may run, including template rendering.
+
+    Going over the budget raises QueryBudgetExceeded when QUERY_BUDGET_ENFORCE is
+    set (it defaults to on under TESTING) and logs a warning otherwise.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with count_queries() as counter:
+                response = view(*args, **kwargs)
+            if counter.count > limit:
+                message = f'{request.endpoint} ran {counter.count} queries, budget is {limit}'
+                if current_app.config.get('QUERY_BUDGET_ENFORCE', current_app.testing):
+                    raise QueryBudgetExceeded(message + ':\n' + '\n'.join(counter.statements))
+                current_app.logger.warning(message)
+            return response
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
@@ -0,0 +1,166 @@
+import json
+import random
+import time
+from datetime import date, datetime, time as clock, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import create_engine, select, insert, desc, and_, text
+from the_greenhouse import db
+from the_greenhouse.models import User, Events, EventAttendee, EventItem, AnyEvent
+from the_greenhouse.archive import attended_events
+
+def hot_queries():
+    """(name, table, statement) for the queries behind the busiest pages.
+
+    table is the one that must be read through an index rather than scanned.
+    Keep these in step with the views they copy.
+    """
+    today = date.today()
+    attended = attended_events(1, date(today.year, 1, 1), date(today.year, 12, 31))
+    return [
+        # core.index, first page
+        ('feed', 'events',
+         select(Events.id).where(Events.event_date >= today)
+         .order_by(desc(Events.created_date), desc(Events.id)).limit(11)),
+        # core.index with a date range
+        ('feed date range', 'events',
+         select(Events.id).where(and_(Events.event_date >= today, Events.event_date <= today + timedelta(days=7)))
+         .order_by(desc(Events.created_date)).limit(10)),
+        # users.user_events
+        ('user events', 'events',
+         select(AnyEvent.id).where(AnyEvent.user_id == 1)
+         .order_by(desc(AnyEvent.created_date), desc(AnyEvent.id)).limit(6)),
+        # users.calendar_data, a year of attendances
+        ('attending calendar', 'event_attendees',
+         select(attended.c.id).order_by(attended.c.event_date, attended.c.event_time)),
+        # The attendance check at the top of every posts view
+        ('attendance check', 'event_attendees',
+         select(EventAttendee.id).where(and_(EventAttendee.event_id == 1, EventAttendee.user_id == 1))),
+        # posts.event, selectinload of attendees and items
+        ('event attendees', 'event_attendees',
+         select(EventAttendee.id).where(EventAttendee.event_id.in_([1]))),
+        ('event items', 'event_items',
+         select(EventItem.id).where(EventItem.event_id.in_([1]))),
+        # posts.items.sync_items
+        ('user items', 'event_items',
+         select(EventItem.id, EventItem.item_name).where(and_(EventItem.event_id == 1, EventItem.user_id == 1))),
+    ]
+
+def _explain_sqlite(connection, sql, params):
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, params).all()
+    return [row[-1] for row in rows]
+
+def _sqlite_scans(plan, table):
+    # 'SCAN events' reads the whole table; 'SCAN events USING INDEX ...' walks an index in order
+    return [line for line in plan if line.split()[:2] == ['SCAN', table] and 'INDEX' not in line]
+
+def _explain_postgresql(connection, sql, params):
+    return connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + sql, params).scalar()
+
+def _postgresql_scans(plan, table):
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    scans = []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if node.get('Node Type') == 'Seq Scan' and node.get('Relation Name') == table:
+            scans.append(f"Seq Scan on {table}")
+        nodes.extend(node.get('Plans', []))
+    return scans
+
+def _explain_mysql(connection, sql, params):
+    result = connection.exec_driver_sql('EXPLAIN ' + sql, params)
+    return [dict(zip(result.keys(), row)) for row in result]
+
+def _mysql_scans(plan, table):
+    return [f"full scan of {table}" for row in plan if row.get('table') == table and row.get('type') == 'ALL']
+
+EXPLAINERS = {
+    'sqlite': (_explain_sqlite, _sqlite_scans),
+    'postgresql': (_explain_postgresql, _postgresql_scans),
+    'mysql': (_explain_mysql, _mysql_scans),
+}
+
+def explain(connection, statement):
+    """EXPLAIN output for statement on connection's database, in the form its dialect gives it."""
+    dialect = connection.dialect
+    run, _ = EXPLAINERS[dialect.name]
+    compiled = statement.compile(dialect=dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    return run(connection, str(compiled), params)
+
+def check_plans(connection):
+    """Run every hot query through EXPLAIN and return {name: (passed, plan, scans)}."""
+    _, scans_of = EXPLAINERS[connection.dialect.name]
+    results = {}
+    for name, table, statement in hot_queries():
+        plan = explain(connection, statement)
+        scans = scans_of(plan, table)
+        results[name] = (not scans, plan, scans)
+    return results
+
+def seed_scratch(engine, events, seed=1):
+    """Fill a fresh database with a feed sized dataset for realistic plans."""
+    rng = random.Random(seed)
+    db.metadata.create_all(engine)
+    users = max(10, events // 20)
+    today = date.today()
+    now = datetime.now()
+    with engine.begin() as connection:
+        connection.execute(insert(User), [
+            {'id': i, 'email': f'user{i}@example.com', 'username': f'user{i}', 'password_hash': 'x',
+             'profile_image': 'default_profile.png'}
+            for i in range(1, users + 1)
+        ])
+        connection.execute(insert(Events), [
+            {'id': i, 'user_id': rng.randint(1, users), 'created_date': now - timedelta(minutes=events - i),
+             'event_title': f'Event {i}', 'event_description': 'Plants and seeds',
+             'event_date': today + timedelta(days=rng.randint(-365, 365)), 'event_time': clock(10),
+             'location': 'Town Hall'}
+            for i in range(1, events + 1)
+        ])
+        attendees, items = [], []
+        for event_id in range(1, events + 1):
+            for user_id in rng.sample(range(1, users + 1), min(users, 4)):
+                attendees.append({'event_id': event_id, 'user_id': user_id, 'attendance_likelihood': 'Maybe',
+                                  'purpose': 'Sell', 'joined_date': now})
+                items.extend({'event_id': event_id, 'user_id': user_id, 'item_name': f'item {n}', 'added_date': now}
+                             for n in range(2))
+        connection.execute(insert(EventAttendee), attendees)
+        connection.execute(insert(EventItem), items)
+        if engine.dialect.name == 'sqlite':
+            connection.execute(text('ANALYZE'))
+
+plans_cli = AppGroup('plans', help='Query plan checks for the hot queries.')
+
+@plans_cli.command('check')
+@click.option('--events', default=20000, show_default=True, help='Events to seed into the scratch SQLite database.')
+@click.option('--current', is_flag=True, help="Check the app's own database as it is instead of a seeded scratch copy.")
+@click.option('--verbose', '-v', is_flag=True, help='Print every plan, not just the failing ones.')
+def check_command(events, current, verbose):
+    """Fail if any hot query scans a whole table instead of using an index."""
+    if current:
+        engine = db.engine
+    else:
+        engine = create_engine('sqlite://')
+        started = time.perf_counter()
+        seed_scratch(engine, events)
+        click.echo(f'Seeded {events} events in {time.perf_counter() - started:.1f}s')
+    with engine.connect() as connection:
+        results = check_plans(connection)
+    failed = 0
+    for name, (passed, plan, scans) in results.items():
+        click.echo(f"{'ok  ' if passed else 'FAIL'} {name}" + ('' if passed else f": {', '.join(scans)}"))
+        if verbose or not passed:
+            for line in plan if isinstance(plan, list) else [plan]:
+                click.echo(f'       {line}')
+        failed += not passed
+    if failed:
+        raise click.ClickException(f'{failed} of {len(results)} hot queries scan a whole table')
+
+def init_app(app):
+    app.cli.add_command(plans_cli)
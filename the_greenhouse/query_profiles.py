@@ -0,0 +1,31 @@
+from sqlalchemy.orm import joinedload, selectinload
+from the_greenhouse.models import Events, EventAttendee, EventItem, EventArchive, EventAttendeeArchive, EventItemArchive, AnyEvent
+
+# Named eager-loading profiles for the read views. Every relationship in models.py
+# is lazy = 'select', so a view that renders related rows should load them through
+# one of these instead of letting the template trigger a query per row.
+PROFILES = {
+    # Event cards on the home feed and user pages show the author's username
+    'event_feed': lambda: (
+        joinedload(Events.author),
+    ),
+    # The event page lists every attendee and item together with its user
+    'event_page': lambda: (
+        joinedload(Events.author),
+        selectinload(Events.attendees).joinedload(EventAttendee.user),
+        selectinload(Events.event_items).joinedload(EventItem.user),
+    ),
+    # User pages list hot and archived events together
+    'any_event_feed': lambda: (
+        joinedload(AnyEvent.author),
+    ),
+    'archived_event_page': lambda: (
+        joinedload(EventArchive.author),
+        selectinload(EventArchive.attendees).joinedload(EventAttendeeArchive.user),
+        selectinload(EventArchive.event_items).joinedload(EventItemArchive.user),
+    ),
+}
+
+def load_profile(name):
+    # Backrefs such as Events.author are there because create_app configures the mappers
+    return PROFILES[name]()
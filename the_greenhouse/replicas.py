@@ -0,0 +1,108 @@
+import random
+import sqlite3
+import time
+from functools import wraps
+
+import click
+from flask import current_app, g, has_request_context, session as cookie_session
+from flask.cli import AppGroup
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+# Cookie session key holding the time until which this browser reads from the primary
+STICKY_KEY = '_db_primary_until'
+
+def replica_bind_keys():
+    return current_app.extensions.get('replicas', [])
+
+def replica_binds(urls, engine_options):
+    # SQLALCHEMY_BINDS entries for the replica URLs, with the same pool settings as the primary
+    return {f'replica_{index}': dict(engine_options(url), url = url) for index, url in enumerate(urls)}
+
+def stuck_to_primary():
+    return cookie_session.get(STICKY_KEY, 0) > time.time()
+
+def read_only(view):
+    """Send the view's SELECTs to a read replica when one is configured.
+
+    The view keeps using the primary if this browser wrote something in the
+    last REPLICA_STICKY_SECONDS (so the page after a flash-and-redirect shows
+    the change), and for the rest of the request once the view itself writes.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        keys = replica_bind_keys()
+        if keys and not stuck_to_primary():
+            g.replica_bind = random.choice(keys)
+        return view(*args, **kwargs)
+    return wrapper
+
+class RoutingSession(Session):
+    """Session that routes plain SELECTs to g.replica_bind, set by @read_only."""
+
+    def get_bind(self, mapper = None, clause = None, bind = None, **kwargs):
+        if bind is None and self._use_replica(clause):
+            return self._db.engines[g.replica_bind]
+        return super().get_bind(mapper, clause = clause, bind = bind, **kwargs)
+
+    def _use_replica(self, clause):
+        if not g or 'replica_bind' not in g:
+            return False
+        # Anything this session has written (or is about to) has to be read back from the primary
+        if self.info.get('replica_wrote') or self._flushing or self.new or self.dirty or self.deleted:
+            return False
+        # Text statements (raw SQL, DDL) could write, so only ORM/Core SELECTs qualify
+        return clause is not None and getattr(clause, 'is_select', False)
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _flushed(session, flush_context):
+    session.info['replica_wrote'] = True
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _bulk_statement(orm_execute_state):
+    # UPDATE/DELETE/INSERT statements run with session.execute() don't go through a flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['replica_wrote'] = True
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _committed(session):
+    if session.info.pop('replica_wrote', False) and has_request_context() and replica_bind_keys():
+        # Give the replicas time to catch up before this browser reads from them again
+        cookie_session[STICKY_KEY] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+        g.pop('replica_bind', None)
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _rolled_back(session):
+    session.info.pop('replica_wrote', None)
+
+replica_cli = AppGroup('replicas', help='Read replica tools.')
+
+@replica_cli.command('sync')
+def sync_command():
+    """Copy a SQLite primary onto SQLite replica files, for trying replica routing locally."""
+    from the_greenhouse import db
+    primary = db.engines[None]
+    if primary.url.get_backend_name() != 'sqlite':
+        raise click.ClickException('Only SQLite databases can be copied; real replicas are kept up to date by the server.')
+    keys = replica_bind_keys()
+    if not keys:
+        click.echo('No replicas configured (DATABASE_REPLICA_URLS).')
+        return
+    source = sqlite3.connect(primary.url.database)
+    try:
+        for key in keys:
+            engine = db.engines[key]
+            # Drop pooled connections so they see the new file contents
+            engine.dispose()
+            target = sqlite3.connect(engine.url.database)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+            click.echo(f'{key}: copied to {engine.url.database}')
+    finally:
+        source.close()
+
+def init_app(app):
+    app.extensions['replicas'] = [key for key in app.config.get('SQLALCHEMY_BINDS', {}) if key.startswith('replica_')]
+    app.cli.add_command(replica_cli)
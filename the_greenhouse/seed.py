@@ -0,0 +1,151 @@
+import random
+import time
+from datetime import date, datetime, time as clock, timedelta, timezone
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, insert, select
+from the_greenhouse import db, hasher
+from the_greenhouse.models import User, Events, EventAttendee, EventItem
+
+# Password of every generated user, so the benchmark can log in as any of them
+SEED_PASSWORD = 'greenhouse-seed'
+
+WORDS = ('tomato', 'basil', 'fern', 'monstera', 'pothos', 'succulent', 'cactus', 'orchid', 'lavender',
+         'rosemary', 'mint', 'pepper', 'strawberry', 'hosta', 'peace lily', 'snake plant', 'begonia',
+         'calathea', 'aloe', 'ivy', 'dahlia', 'tulip bulbs', 'seed packets', 'compost', 'terracotta pots')
+PLACES = ('Town Hall', 'Community Garden', 'Library Annex', 'Riverside Park', 'Market Square',
+          'Greenhouse Cafe', 'Allotments', 'Church Hall', 'High School Gym', 'Botanic Garden')
+LIKELIHOODS = ('Definitely', 'Possibly', 'Maybe')
+PURPOSES = ('Buy', 'Sell', 'Both')
+
+def _next_id(model):
+    return (db.session.scalar(select(func.max(model.id))) or 0) + 1
+
+def _batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def generate(users, events, attendees = 8, items = 3, batch_size = 5000, seed = 1, progress = None):
+    """Append users, events, attendees and items to the app's database.
+
+    attendees is the average per event and items the average per selling
+    attendee. Event popularity is skewed (a few events draw most attendees)
+    and event counters are filled in to match. Rows are written with
+    multi-row INSERTs of batch_size, committing after each batch, so memory
+    stays flat from a thousand rows up to tens of millions.
+
+    Returns the number of rows written per table.
+    """
+    rng = random.Random(seed)
+    progress = progress or (lambda table, written: None)
+    written = {'users': 0, 'events': 0, 'event_attendees': 0, 'event_items': 0}
+    now = datetime.now(timezone.utc)
+    today = date.today()
+
+    first_user = _next_id(User)
+    password_hash = hasher.hash(SEED_PASSWORD)
+    user_ids = range(first_user, first_user + users)
+    for batch in _batches(({'id': user_id, 'email': f'seed{user_id}@example.com', 'username': f'seed{user_id}',
+                            'password_hash': password_hash, 'profile_image': 'default_profile.png'}
+                           for user_id in user_ids), batch_size):
+        db.session.execute(insert(User), batch)
+        db.session.commit()
+        written['users'] += len(batch)
+        progress('users', written['users'])
+
+    first_event = _next_id(Events)
+    first_attendee = _next_id(EventAttendee)
+    first_item = _next_id(EventItem)
+    event_rows, attendee_rows, item_rows = [], [], []
+
+    def flush_rows():
+        # Events first so the attendee and item foreign keys resolve
+        for table, rows, model in (('events', event_rows, Events), ('event_attendees', attendee_rows, EventAttendee),
+                                   ('event_items', item_rows, EventItem)):
+            if rows:
+                db.session.execute(insert(model), rows)
+                written[table] += len(rows)
+                progress(table, written[table])
+                rows.clear()
+        db.session.commit()
+
+    for offset in range(events):
+        event_id = first_event + offset
+        author = rng.choice(user_ids)
+        # Pareto gives a long tail: most events are small, a few are very busy
+        crowd = min(len(user_ids), int(rng.paretovariate(1.5) * attendees / 3))
+        guests = {author}
+        guests.update(rng.sample(user_ids, crowd) if crowd else ())
+        counters = dict.fromkeys(('attendee_count', 'definitely_count', 'possibly_count', 'maybe_count',
+                                  'buying_count', 'selling_count', 'both_count', 'item_count'), 0)
+        created = now - timedelta(minutes=(events - offset) * 7)
+        for user_id in guests:
+            likelihood = 'Definitely' if user_id == author else rng.choice(LIKELIHOODS)
+            purpose = rng.choice(PURPOSES)
+            names = []
+            if purpose != 'Buy':
+                names = [rng.choice(WORDS) for _ in range(max(0, int(rng.expovariate(1 / items))))]
+            attendee_rows.append({'id': first_attendee, 'event_id': event_id, 'user_id': user_id,
+                                  'attendance_likelihood': likelihood, 'purpose': purpose,
+                                  'items_bringing': '\n'.join(names) or None, 'joined_date': created})
+            first_attendee += 1
+            for name in names:
+                item_rows.append({'id': first_item, 'event_id': event_id, 'user_id': user_id,
+                                  'item_name': name, 'added_date': created})
+                first_item += 1
+            counters['attendee_count'] += 1
+            counters[f'{likelihood.lower()}_count'] += 1
+            counters[{'Buy': 'buying_count', 'Sell': 'selling_count', 'Both': 'both_count'}[purpose]] += 1
+            counters['item_count'] += len(names)
+        event_rows.append(dict(
+            counters, id=event_id, user_id=author, created_date=created,
+            event_title=f'{rng.choice(WORDS).title()} {rng.choice(("Swap", "Sale", "Fair", "Exchange", "Meetup"))}',
+            event_description=f'Bring your {rng.choice(WORDS)} and {rng.choice(WORDS)}.',
+            event_date=today + timedelta(days=rng.randint(-180, 365)),
+            event_time=clock(rng.randint(8, 19), rng.choice((0, 30))),
+            location=rng.choice(PLACES),
+        ))
+        if len(event_rows) >= batch_size or len(attendee_rows) >= batch_size or len(item_rows) >= batch_size:
+            flush_rows()
+    flush_rows()
+    return written
+
+@click.command('seed')
+@click.option('--users', default=1000, show_default=True, help='Users to add.')
+@click.option('--events', default=5000, show_default=True, help='Events to add.')
+@click.option('--attendees', default=8, show_default=True, help='Average attendees per event.')
+@click.option('--items', default=3, show_default=True, help='Average items per selling attendee.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per INSERT.')
+@click.option('--seed', 'random_seed', default=1, show_default=True, help='Random seed, for repeatable datasets.')
+@click.option('--no-index', is_flag=True, help='Skip rebuilding the search index afterwards.')
+@with_appcontext
+def seed_command(users, events, attendees, items, batch_size, random_seed, no_index):
+    """Add generated users, events, attendees and items for load testing.
+
+    Every generated user is seed<id>@example.com with the password
+    'greenhouse-seed'. Don't run this against production.
+    """
+    started = time.perf_counter()
+    last = {}
+
+    def progress(table, written):
+        if written - last.get(table, 0) >= batch_size * 20:
+            click.echo(f'  {table}: {written}')
+            last[table] = written
+
+    written = generate(users, events, attendees, items, batch_size, random_seed, progress)
+    click.echo(', '.join(f'{count} {table}' for table, count in written.items())
+               + f' in {time.perf_counter() - started:.1f}s')
+    if not no_index:
+        from the_greenhouse.core.search import rebuild_command
+        click.get_current_context().invoke(rebuild_command)
+
+def init_app(app):
+    app.cli.add_command(seed_command)
@@ -0,0 +1,223 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import time
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup
+from PIL import Image
+
+# Build output, under the static folder so the static route serves it
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+
+# Not fingerprinted: uploads in progress, and avatars already named after their pixels
+SKIP_DIRS = ('temp', BUILD_DIR)
+CONTENT_ADDRESSED = re.compile(r'^profile_pics/[0-9a-f]{24}-\d+\.(jpg|webp)$')
+
+# Precompressed next to the fingerprinted file; images are compressed already
+TEXT_EXTENSIONS = ('.css', '.js', '.mjs', '.json', '.svg', '.txt', '.html', '.xml', '.map', '.ico')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Site images get WebP copies at these widths (no wider than the original)
+IMAGE_DIRS = ('website',)
+IMAGE_WIDTHS = (480, 960, 1600)
+WEBP_OPTIONS = {'quality': 80, 'method': 6}
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+def _digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()[:12]
+
+def _hashed_name(name, digest):
+    root, ext = os.path.splitext(name)
+    return f'{root}.{digest}{ext}'
+
+def _write_once(path, write):
+    # Hashed names never change content, so an existing file is already right
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    write(temp_path)
+    os.replace(temp_path, path)
+
+def _compress(path, encodings):
+    with open(path, 'rb') as handle:
+        data = handle.read()
+    written = []
+    for encoding, suffix in ENCODINGS:
+        if encoding not in encodings:
+            continue
+        if encoding == 'br':
+            import brotli
+            compressed = brotli.compress(data, quality=11)
+        else:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        # Not worth a second file unless it saves something
+        if len(compressed) < len(data) * 0.9:
+            def write(temp_path, compressed=compressed):
+                with open(temp_path, 'wb') as out:
+                    out.write(compressed)
+            _write_once(path + suffix, write)
+            written.append(encoding)
+    return written
+
+def _webp_variants(source, target_root, digest, out_dir):
+    variants = []
+    with Image.open(source) as image:
+        width, height = image.size
+        widths = [w for w in IMAGE_WIDTHS if w < width] or [width]
+        for target_width in widths:
+            name = f'{target_root}-{target_width}w.{digest}.webp'
+
+            def write(temp_path, target_width=target_width):
+                resized = image.convert('RGB')
+                resized.thumbnail((target_width, round(height * target_width / width)), Image.Resampling.LANCZOS)
+                resized.save(temp_path, 'WEBP', **WEBP_OPTIONS)
+            _write_once(os.path.join(out_dir, name), write)
+            variants.append([target_width, f'{BUILD_DIR}/{name}'])
+    return variants
+
+def build(static_folder, encodings = ('br', 'gzip'), progress = None):
+    """Fingerprint everything under static_folder into static_folder/build.
+
+    Writes name.<hash>.ext copies, gzip/brotli versions of text assets,
+    WebP variants of the site images and a manifest mapping each original
+    name to its build outputs. Returns the manifest.
+    """
+    progress = progress or (lambda name: None)
+    out_root = os.path.join(static_folder, BUILD_DIR)
+    manifest = {'files': {}, 'encodings': {}, 'webp': {}}
+    for directory, dirs, files in os.walk(static_folder):
+        relative_dir = os.path.relpath(directory, static_folder)
+        if relative_dir == '.':
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+            relative_dir = ''
+        for filename in sorted(files):
+            name = os.path.join(relative_dir, filename).replace(os.sep, '/')
+            if CONTENT_ADDRESSED.match(name) or filename.endswith('.tmp'):
+                continue
+            source = os.path.join(directory, filename)
+            digest = _digest(source)
+            hashed = _hashed_name(name, digest)
+            target = os.path.join(out_root, hashed)
+            _write_once(target, lambda temp_path: shutil.copyfile(source, temp_path))
+            manifest['files'][name] = f'{BUILD_DIR}/{hashed}'
+
+            if filename.lower().endswith(TEXT_EXTENSIONS):
+                written = _compress(target, encodings)
+                if written:
+                    manifest['encodings'][f'{BUILD_DIR}/{hashed}'] = written
+            if relative_dir.split('/')[0] in IMAGE_DIRS and filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+                manifest['webp'][name] = _webp_variants(source, os.path.splitext(name)[0], digest, out_root)
+            progress(name)
+
+    with open(os.path.join(out_root, MANIFEST), 'w') as handle:
+        json.dump(manifest, handle, indent=2, sort_keys=True)
+    return manifest
+
+def load_manifest(static_folder):
+    path = os.path.join(static_folder, BUILD_DIR, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        return json.load(handle)
+
+def _fingerprint_url(endpoint, values):
+    # url_for('static', filename='x.jpg') -> /static/build/x.<hash>.jpg
+    if endpoint != 'static' or 'filename' not in values:
+        return
+    manifest = current_app.extensions.get('static_manifest')
+    if manifest:
+        values['filename'] = manifest['files'].get(values['filename'], values['filename'])
+
+def webp_srcset(filename):
+    """srcset of the WebP variants built for a static image, '' before a build."""
+    manifest = current_app.extensions.get('static_manifest')
+    variants = manifest['webp'].get(filename) if manifest else None
+    if not variants:
+        return ''
+    return ', '.join(f"{url_for('static', filename=path)} {width}w" for width, path in variants)
+
+def _is_immutable(filename):
+    manifest = current_app.extensions.get('static_manifest')
+    if filename.startswith(BUILD_DIR + '/') and manifest is not None:
+        return True
+    return bool(CONTENT_ADDRESSED.match(filename))
+
+def static_view(filename):
+    """The static route, with far-future caching for files whose names change with their content.
+
+    Files go out through send_file with their path, so gunicorn hands them to
+    sendfile() (or the front server, with USE_X_SENDFILE) instead of copying
+    them through Python. Fingerprinted text assets are sent precompressed
+    when the client accepts it.
+    """
+    if not _is_immutable(filename):
+        return current_app.send_static_file(filename)
+
+    manifest = current_app.extensions['static_manifest'] or {}
+    encoding = None
+    for accepted in manifest.get('encodings', {}).get(filename, ()):
+        if accepted in request.accept_encodings:
+            encoding = accepted
+            break
+    if encoding is None:
+        response = send_from_directory(current_app.static_folder, filename, max_age=IMMUTABLE_MAX_AGE)
+    else:
+        suffix = dict(ENCODINGS)[encoding]
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(current_app.static_folder, filename + suffix,
+                                       max_age=IMMUTABLE_MAX_AGE, mimetype=mimetype)
+        response.content_encoding = encoding
+    if filename in manifest.get('encodings', {}):
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+assets_cli = AppGroup('assets', help='Build fingerprinted, precompressed static files.')
+
+@assets_cli.command('build')
+@click.option('--no-brotli', is_flag=True, help='Only gzip text assets.')
+def build_command(no_brotli):
+    """Fingerprint static files, precompress text assets and write WebP variants of the site images.
+
+    Run on deploy (and after changing anything in static/); the app picks up
+    the manifest when it starts.
+    """
+    encodings = ('gzip',) if no_brotli else ('br', 'gzip')
+    if 'br' in encodings:
+        try:
+            import brotli
+        except ImportError:
+            click.echo('brotli is not installed, writing gzip only')
+            encodings = ('gzip',)
+    started = time.perf_counter()
+    manifest = build(current_app.static_folder, encodings)
+    variants = sum(len(v) for v in manifest['webp'].values())
+    click.echo(f"{len(manifest['files'])} files, {len(manifest['encodings'])} precompressed, "
+               f'{variants} WebP variants in {time.perf_counter() - started:.1f}s')
+
+@assets_cli.command('clean')
+def clean_command():
+    """Remove the build, so static files are served under their own names again."""
+    shutil.rmtree(os.path.join(current_app.static_folder, BUILD_DIR), ignore_errors=True)
+    click.echo('Removed static build')
+
+def init_app(app):
+    app.extensions['static_manifest'] = load_manifest(app.static_folder) if app.config['STATIC_FINGERPRINT'] else None
+    app.url_defaults(_fingerprint_url)
+    app.view_functions['static'] = static_view
+    app.add_template_global(webp_srcset)
+    app.cli.add_command(assets_cli)
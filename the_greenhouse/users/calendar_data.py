@@ -0,0 +1,91 @@
+import calendar
+from datetime import date
+
+from flask import current_app, url_for
+from sqlalchemy import select
+from the_greenhouse import db, cache
+from the_greenhouse.archive import attended_events
+
+def _tag(user_id):
+    return f'calendar:{user_id}'
+
+def attendances(user_id, year):
+    """Events user_id is attending in year, as {date: [event dict, ...]} in date and time order.
+
+    Loaded with one query per user and year and cached, so moving between
+    months doesn't go back to the database. Entries carry each event's tag,
+    so editing or deleting an event drops the calendars that show it.
+    """
+    key = f'calendar:{user_id}:{year}'
+    by_date = cache.get(key)
+    if by_date is not None:
+        return by_date
+
+    # Past years may have been archived, so read both sides
+    attended = attended_events(user_id, date(year, 1, 1), date(year, 12, 31))
+    rows = db.session.execute(
+        select(attended.c.id, attended.c.event_title, attended.c.event_date, attended.c.event_time, attended.c.location)
+        .order_by(attended.c.event_date, attended.c.event_time)
+    ).all()
+
+    by_date = {}
+    for event_id, title, event_date, event_time, location in rows:
+        by_date.setdefault(event_date, []).append(
+            {'id': event_id, 'event_title': title, 'event_time': event_time, 'location': location}
+        )
+    tags = [_tag(user_id)] + [f'event:{row[0]}' for row in rows]
+    cache.set(key, by_date, ttl=current_app.config['CALENDAR_CACHE_TTL'], tags=tags)
+    return by_date
+
+def invalidate_calendars(*user_ids):
+    # After the users join or leave an event, or one they attend moves to another year
+    cache.invalidate_tags(*(_tag(user_id) for user_id in user_ids))
+
+def month_data(user_id, year, month):
+    """Everything the account calendar needs for one month."""
+    month = max(1, min(12, month))
+    first_day = date(year, month, 1)
+    days_in_month = calendar.monthrange(year, month)[1]
+    by_date = attendances(user_id, year)
+    events_by_date = {day: events for day, events in by_date.items() if day.month == month}
+    prev_month, prev_year = (12, year - 1) if month == 1 else (month - 1, year)
+    next_month, next_year = (1, year + 1) if month == 12 else (month + 1, year)
+    return {
+        'month': month,
+        'year': year,
+        'month_name': calendar.month_name[month],
+        'first_day': first_day,
+        'last_day': date(year, month, days_in_month),
+        'first_weekday': first_day.weekday(),  # Monday is 0, Sunday is 6
+        'month_dates': [date(year, month, day) for day in range(1, days_in_month + 1)],
+        'events_by_date': events_by_date,
+        'prev_month': prev_month,
+        'prev_year': prev_year,
+        'next_month': next_month,
+        'next_year': next_year,
+    }
+
+def month_json(data):
+    # JSON form of month_data for the calendar's client-side navigation
+    return {
+        'month': data['month'],
+        'year': data['year'],
+        'month_name': data['month_name'],
+        'first_weekday': data['first_weekday'],
+        'days_in_month': data['last_day'].day,
+        'prev': {'month': data['prev_month'], 'year': data['prev_year']},
+        'next': {'month': data['next_month'], 'year': data['next_year']},
+        'events': [
+            {
+                'id': event['id'],
+                'title': event['event_title'],
+                'date': day.isoformat(),
+                'day': day.day,
+                'date_label': day.strftime('%B %d'),
+                'time': event['event_time'].strftime('%I:%M %p'),
+                'location': event['location'],
+                'url': url_for('posts.event', event_id=event['id']),
+            }
+            for day, events in data['events_by_date'].items() for event in events
+        ],
+    }
@@ -3,12 +3,44 @@ from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, Email, EqualTo
 from wtforms import ValidationError
 from flask_wtf.file import FileField, FileAllowed
-from sqlalchemy import select
+from sqlalchemy import select, or_
 
 from the_greenhouse import db
 from flask_login import current_user
 from the_greenhouse.models import User
 
+UNIQUE_MESSAGES = {
+    'email': 'This email is already registered.',
+    'username': 'This username is already taken.',
+}
+
+def check_unique(form, exclude_id=None):
+    # One query for both the email and the username instead of one per field
+    query = select(User.email, User.username).where(
+        or_(User.email == form.email.data, User.username == form.username.data)
+    )
+    if exclude_id is not None:
+        query = query.where(User.id != exclude_id)
+    valid = True
+    for email, username in db.session.execute(query):
+        for field, value in (('email', email), ('username', username)):
+            if value == form[field].data and UNIQUE_MESSAGES[field] not in form[field].errors:
+                form[field].errors.append(UNIQUE_MESSAGES[field])
+                valid = False
+    return valid
+
+def add_unique_errors(form, error):
+    """Map a unique constraint IntegrityError from saving a User onto the form's fields.
+
+    Covers the race where two sign-ups pass check_unique at the same time.
+    Returns False if the error isn't about the email or username.
+    """
+    message = str(error.orig).lower()
+    fields = [field for field in UNIQUE_MESSAGES if field in message]
+    for field in fields:
+        form[field].errors.append(UNIQUE_MESSAGES[field])
+    return bool(fields)
+
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
     password = PasswordField('Password', validators=[DataRequired()])
@@ -21,19 +53,10 @@ class RegisterForm(FlaskForm):
     confirm_pass = PasswordField('Confirm Password', validators=[DataRequired(), EqualTo('password', message='Passwords must match!')])
     submit = SubmitField('Sign Up Now!')
 
-    def validate_email(self, field):
-        user = db.session.execute(
-            select(User).filter_by(email=field.data)
-        ).scalar_one_or_none()
-        if user:
-            raise ValidationError("This email is already registered.")
-
-    def validate_username(self, field):
-        user = db.session.execute(
-            select(User).filter_by(username=field.data)
-        ).scalar_one_or_none()
-        if user:
-            raise ValidationError("This username is already taken.")
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        return check_unique(self)
         
 class UpdateUserForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -41,16 +64,7 @@ class UpdateUserForm(FlaskForm):
     picture = FileField('Update Profile Picture', validators = [FileAllowed(['jpg', 'jpeg', 'png', 'gif'])])
     submit = SubmitField('Save Changes')
 
-    def validate_email(self, field):
-        user = db.session.execute(
-            select(User).filter_by(email=field.data)
-        ).scalar_one_or_none()
-        if user and user != current_user:
-            raise ValidationError("This email is already registered.")
-
-    def validate_username(self, field):
-        user = db.session.execute(
-            select(User).filter_by(username=field.data)
-        ).scalar_one_or_none()
-        if user and user != current_user:
-            raise ValidationError("This username is already taken.")
\ No newline at end of file
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        return check_unique(self, exclude_id=current_user.id)
\ No newline at end of file
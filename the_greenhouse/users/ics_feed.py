@@ -0,0 +1,113 @@
+import hashlib
+from datetime import date, datetime, time, timedelta, timezone
+
+from flask import current_app, request, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import func, select, union_all
+from the_greenhouse import db
+from the_greenhouse.archive import attended_events
+from the_greenhouse.models import Events, EventAttendee, EventArchive, EventAttendeeArchive
+
+# How far back the feed goes; upcoming events are always included
+PAST_DAYS = 365
+
+# Events whose rows are fetched from the cursor at a time
+BATCH_SIZE = 200
+
+STATUS = {'Definitely': 'CONFIRMED', 'Possibly': 'TENTATIVE', 'Maybe': 'TENTATIVE'}
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt = 'calendar-feed')
+
+def feed_token(user_id):
+    # Anyone with the link can read the feed; changing SECRET_KEY revokes every link
+    return _serializer().dumps(user_id)
+
+def user_id_from_token(token):
+    try:
+        user_id = _serializer().loads(token)
+    except BadSignature:
+        return None
+    return user_id if isinstance(user_id, int) else None
+
+def _escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+def _fold(line):
+    # Content lines are at most 75 octets, continued on lines starting with a space
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts = []
+    while data:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(data))
+        # Don't split a multi-byte character
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(data[:cut].decode('utf-8'))
+        data = data[cut:]
+    return '\r\n '.join(parts) + '\r\n'
+
+def _vevent(row, stamp, host):
+    event_id, title, description, event_date, event_time, location, likelihood = row
+    start = datetime.combine(event_date, event_time)
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:event-{event_id}@{host}',
+        f'DTSTAMP:{stamp}',
+        f'DTSTART:{start:%Y%m%dT%H%M%S}',
+        f'SUMMARY:{_escape(title)}',
+        f'LOCATION:{_escape(location)}',
+        f'DESCRIPTION:{_escape(description)}',
+        f"URL:{url_for('posts.event', event_id=event_id, _external=True)}",
+        f"STATUS:{STATUS.get(likelihood, 'TENTATIVE')}",
+        'END:VEVENT',
+    ]
+    return ''.join(_fold(line) for line in lines)
+
+def feed_version(user_id):
+    """(etag, last_modified) of the user's current feed, from the rows in it, in one query.
+
+    Every worker computes the same version, before and after a restart. The
+    count changes when an attendance or event goes away, and edits bump
+    updated_at on the event or attendance row. Last-Modified is at least
+    midnight today, since the window of past events moves daily.
+    """
+    start = date.today() - timedelta(days=PAST_DAYS)
+    def side(event, attendee):
+        return (select(func.count(), func.max(event.updated_at), func.max(attendee.updated_at))
+                .select_from(attendee)
+                .join(event, event.id == attendee.event_id)
+                .where(attendee.user_id == user_id, event.event_date >= start))
+    rows = db.session.execute(union_all(side(Events, EventAttendee), side(EventArchive, EventAttendeeArchive))).all()
+    count = sum(row[0] for row in rows)
+    # DateTime columns come back naive, holding UTC
+    stamps = [stamp.replace(tzinfo=timezone.utc) for row in rows for stamp in row[1:] if stamp is not None]
+    # HTTP dates are whole seconds; the ETag keeps the full precision
+    last_modified = max(stamps + [datetime.combine(date.today(), time(), timezone.utc)]).replace(microsecond=0)
+    key = repr((user_id, start, count, max(stamps, default=None), current_app.config['RELEASE_VERSION']))
+    return hashlib.sha1(key.encode()).hexdigest(), last_modified
+
+def generate_feed(user_id, version):
+    """Yield the user's attended events as an iCalendar file.
+
+    Rows come from a server-side cursor a batch at a time, so memory stays
+    flat however many events the user attends.
+    """
+    stamp = f'{version[1]:%Y%m%dT%H%M%SZ}'
+    host = request.host.split(':')[0]
+    yield ''.join(_fold(line) for line in (
+        'BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//The Greenhouse//Events//EN', 'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH', 'X-WR-CALNAME:The Greenhouse', 'REFRESH-INTERVAL;VALUE=DURATION:PT1H',
+    ))
+
+    attended = attended_events(user_id, start=date.today() - timedelta(days=PAST_DAYS))
+    rows = db.session.execute(
+        select(attended)
+        .order_by(attended.c.event_date, attended.c.event_time)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+    for batch in rows.partitions():
+        yield ''.join(_vevent(row, stamp, host) for row in batch)
+    yield 'END:VCALENDAR\r\n'
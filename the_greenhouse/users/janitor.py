@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+from the_greenhouse import db
+from the_greenhouse.models import User
+from the_greenhouse.file_lock import try_lock
+from the_greenhouse.users.pfp_handler import avatar_dir, avatar_files
+
+# Always kept, used by handleImageError and as the column default
+PROTECTED_AVATARS = {'default_profile.png'}
+
+def _sweep(directory, should_delete, batch_size, max_batches, dry_run):
+    # Deletes at most batch_size files per batch, and stops after max_batches
+    metrics = {'scanned': 0, 'deleted': 0, 'bytes_freed': 0, 'errors': 0, 'batches': 0}
+    if not os.path.isdir(directory):
+        return metrics
+    batch = []
+
+    def flush():
+        metrics['batches'] += 1
+        for entry in batch:
+            try:
+                size = entry.stat().st_size
+                if not dry_run:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                continue  # Removed by someone else in the meantime
+            except OSError:
+                metrics['errors'] += 1
+                continue
+            metrics['deleted'] += 1
+            metrics['bytes_freed'] += size
+        batch.clear()
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            metrics['scanned'] += 1
+            if should_delete(entry):
+                batch.append(entry)
+                if len(batch) >= batch_size:
+                    flush()
+                    if metrics['batches'] >= max_batches:
+                        break
+    if batch:
+        flush()
+    return metrics
+
+def sweep_temp(max_age, batch_size, max_batches, dry_run=False):
+    """Delete uploads in static/temp that were never cropped within max_age seconds."""
+    cutoff = time.time() - max_age
+    temp_dir = os.path.join(current_app.root_path, 'static', 'temp')
+    return _sweep(temp_dir, lambda entry: entry.stat().st_mtime < cutoff, batch_size, max_batches, dry_run)
+
+def sweep_avatars(grace, batch_size, max_batches, dry_run=False):
+    """Delete files in static/profile_pics that no User.profile_image refers to.
+
+    Files younger than grace seconds are kept, so a picture that a job has just
+    written is not removed before the job's handler points the user at it.
+    """
+    referenced = set(PROTECTED_AVATARS)
+    for profile_image in db.session.scalars(select(User.profile_image).distinct()):
+        referenced.update(avatar_files(profile_image))
+    cutoff = time.time() - grace
+
+    def orphaned(entry):
+        return entry.name not in referenced and entry.stat().st_mtime < cutoff
+
+    return _sweep(avatar_dir(), orphaned, batch_size, max_batches, dry_run)
+
+def run_janitor(dry_run=False):
+    config = current_app.config
+    # Only one worker process sweeps at a time
+    with try_lock(os.path.join(current_app.instance_path, 'janitor.lock')) as locked:
+        if not locked:
+            return None
+        started = time.perf_counter()
+        metrics = {
+            'temp': sweep_temp(config['JANITOR_TEMP_MAX_AGE'], config['JANITOR_BATCH_SIZE'],
+                               config['JANITOR_MAX_BATCHES'], dry_run),
+            'avatars': sweep_avatars(config['JANITOR_AVATAR_GRACE'], config['JANITOR_BATCH_SIZE'],
+                                     config['JANITOR_MAX_BATCHES'], dry_run),
+        }
+        metrics['seconds'] = round(time.perf_counter() - started, 3)
+    current_app.logger.info('Janitor%s: %s', ' (dry run)' if dry_run else '', metrics)
+    return metrics
+
+def _janitor_loop(app, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                run_janitor()
+            except Exception:
+                app.logger.exception('Janitor run failed')
+            finally:
+                db.session.remove()
+
+@click.command('janitor')
+@click.option('--dry-run', is_flag=True, help='Report what would be deleted without deleting it.')
+@with_appcontext
+def janitor_command(dry_run):
+    """Delete abandoned temp uploads and unreferenced profile pictures."""
+    metrics = run_janitor(dry_run)
+    if metrics is None:
+        click.echo('Another janitor run is in progress.')
+        return
+    for area in ('temp', 'avatars'):
+        click.echo(f"{area}: " + ', '.join(f'{key}={value}' for key, value in metrics[area].items()))
+    click.echo(f"took {metrics['seconds']}s")
+
+def init_app(app):
+    app.cli.add_command(janitor_command)
+    interval = app.config['JANITOR_INTERVAL']
+    if interval:
+        threading.Thread(target=_janitor_loop, args=(app, interval), name='janitor', daemon=True).start()
@@ -1,55 +1,163 @@
+import hashlib
+import math
 import os
+import sys
+import time
 from PIL import Image
 from flask import url_for, current_app
 
-def add_profile_pic(pic_upload, username, crop_data=None):
+try:
+    import resource
+except ImportError:
+    # Windows has no getrusage
+    resource = None
 
-    # Handle both file upload objects and file paths
-    if hasattr(pic_upload, 'filename'):
-        # It's a file upload object
-        filename = pic_upload.filename
-        image_source = pic_upload
-    else:
-        # It's a file path string
-        filename = os.path.basename(pic_upload)
-        image_source = pic_upload
-    
-    ext_type = filename.split('.')[-1].lower()
-    
-    # Support GIF, but convert to PNG for consistency
-    if ext_type == 'gif':
-        ext_type = 'png'
-    
-    storage_filename = str(username) + '.' + ext_type
-    filepath = os.path.join(current_app.root_path, 'static/profile_pics', storage_filename)
+# Square sizes written for every avatar, smallest first
+AVATAR_SIZES = (32, 64, 128, 300)
+
+# File extension -> (PIL format, save options)
+AVATAR_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 6}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+class UploadTooLarge(Exception):
+    pass
+
+def save_upload(file_storage, path, max_bytes, chunk_size = 64 * 1024):
+    # Copy the upload in chunks, giving up as soon as it passes max_bytes
+    written = 0
+    try:
+        with open(path, 'wb') as out:
+            while True:
+                chunk = file_storage.stream.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(f'Upload is larger than {max_bytes} bytes')
+                out.write(chunk)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return written
+
+def avatar_dir():
+    return os.path.join(current_app.root_path, 'static/profile_pics')
+
+def avatar_filename(digest, size, ext):
+    return f'{digest}-{size}.{ext}'
+
+def is_legacy_avatar(profile_image):
+    # Pictures saved before content addressing are stored as a single file name (e.g. 'default_profile.png')
+    return '.' in profile_image
+
+def avatar_url(profile_image, size, ext = 'jpg'):
+    """URL of the smallest stored rendition of profile_image that is at least size pixels."""
+    if is_legacy_avatar(profile_image):
+        return url_for('static', filename='profile_pics/' + profile_image)
+    fit = next((s for s in AVATAR_SIZES if s >= size), AVATAR_SIZES[-1])
+    return url_for('static', filename='profile_pics/' + avatar_filename(profile_image, fit, ext))
+
+def avatar_srcset(profile_image, size, ext = 'jpg'):
+    return f'{avatar_url(profile_image, size, ext)} 1x, {avatar_url(profile_image, size * 2, ext)} 2x'
+
+def avatar_files(profile_image):
+    # Every file stored for a profile_image value
+    if is_legacy_avatar(profile_image):
+        return [profile_image]
+    return [avatar_filename(profile_image, size, ext) for size in AVATAR_SIZES for ext in AVATAR_FORMATS]
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def process_profile_pic(image_source, dest_dir, crop_data=None, remove_source=False):
+    # Runs in the job worker process, so it must not touch the app or database
+    started = time.perf_counter()
 
     # Create directory if it doesn't exist
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    os.makedirs(dest_dir, exist_ok=True)
 
-    output_size = (300, 300)
+    output_size = (AVATAR_SIZES[-1], AVATAR_SIZES[-1])
 
+    # Only reads the header, no pixels are decoded yet
     pic = Image.open(image_source)
-    
-    # Convert to RGB if necessary (for GIFs, etc.)
-    if pic.mode in ('RGBA', 'LA', 'P'):
-        pic = pic.convert('RGB')
-    
-    # Apply cropping if crop data is provided
+    source_size = pic.size
+
+    # Crop box in the original image's pixel coordinates
     if crop_data:
         x, y, width, height = crop_data
-        pic = pic.crop((x, y, x + width, y + height))
-    
+    else:
+        x, y, (width, height) = 0, 0, source_size
+
+    # Largest downscale that still leaves the cropped area at least output_size
+    scale = max(1, min(width, height) // output_size[0])
+    if scale > 1 and pic.format == 'JPEG':
+        # JPEG can decode straight to 1/2, 1/4 or 1/8 size, so full resolution pixels are never loaded
+        pic.draft('RGB', (math.ceil(source_size[0] / scale), math.ceil(source_size[1] / scale)))
+    pic.load()
+    decoded_size = pic.size
+
+    # Convert to RGB if necessary (for GIFs, etc.)
+    if pic.mode != 'RGB':
+        pic = pic.convert('RGB')
+
+    # Map the crop box onto whatever size the decoder produced
+    ratio_x = decoded_size[0] / source_size[0]
+    ratio_y = decoded_size[1] / source_size[1]
+    box = (round(x * ratio_x), round(y * ratio_y), round((x + width) * ratio_x), round((y + height) * ratio_y))
+
+    # Formats without draft support get a cheap integer reduce before the LANCZOS pass
+    remaining = max(1, min(box[2] - box[0], box[3] - box[1]) // output_size[0])
+    if remaining > 1:
+        pic = pic.reduce(remaining, box=box)
+    elif crop_data or box != (0, 0) + decoded_size:
+        pic = pic.crop(box)
+
     # Resize to square aspect ratio
     pic.thumbnail(output_size, Image.Resampling.LANCZOS)
-    
+
     # Create a square image with white background
     square_pic = Image.new('RGB', output_size, (255, 255, 255))
-    
+
     # Calculate position to center the image
     x_offset = (output_size[0] - pic.size[0]) // 2
     y_offset = (output_size[1] - pic.size[1]) // 2
     square_pic.paste(pic, (x_offset, y_offset))
-    
-    square_pic.save(filepath, 'PNG', quality=95)
 
-    return storage_filename
\ No newline at end of file
+    # Files are named after their pixels, so they never change and can be cached forever
+    digest = hashlib.sha256(square_pic.tobytes()).hexdigest()[:24]
+
+    for size in AVATAR_SIZES:
+        resized = square_pic if size == output_size[0] else square_pic.resize((size, size), Image.Resampling.LANCZOS)
+        for ext, (image_format, options) in AVATAR_FORMATS.items():
+            filepath = os.path.join(dest_dir, avatar_filename(digest, size, ext))
+            if os.path.exists(filepath):
+                continue  # Same picture uploaded before
+            # Write then rename so a half written file is never served
+            temp_path = f'{filepath}.{os.getpid()}.tmp'
+            resized.save(temp_path, image_format, **options)
+            os.replace(temp_path, filepath)
+
+    if remove_source:
+        os.remove(image_source)
+
+    metrics = {
+        'source_size': source_size,
+        'decoded_size': decoded_size,
+        # Pixel buffer of the largest image held in memory, at 4 bytes per pixel
+        'decoded_bytes': decoded_size[0] * decoded_size[1] * 4,
+        # High-water mark of the whole pool process since it started, not of this job. Pillow's
+        # pixel buffers are invisible to tracemalloc, so decoded_bytes is the per-job figure
+        'worker_peak_rss_kb': _peak_rss_kb(),
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    return {'profile_image': digest, 'metrics': metrics}
+
+def add_profile_pic(pic_upload, crop_data=None):
+    return process_profile_pic(pic_upload, avatar_dir(), crop_data)['profile_image']
\ No newline at end of file
@@ -1,19 +1,42 @@
-from flask import render_template, url_for, flash, redirect, request, Blueprint, abort, session, current_app
+from flask import render_template, url_for, flash, redirect, request, Blueprint, abort, session, current_app, jsonify, Response, stream_with_context
 from flask_login import login_user, current_user, logout_user, login_required
-from sqlalchemy import select, desc, and_
-from the_greenhouse import db
-from the_greenhouse.models import User, Events, EventAttendee
-from the_greenhouse.users.forms import RegisterForm, LoginForm, UpdateUserForm
-from the_greenhouse.users.pfp_handler import add_profile_pic
+from sqlalchemy import select, desc
+from sqlalchemy.exc import IntegrityError
+from the_greenhouse import db, jobs
+from the_greenhouse.models import User, AnyEvent
+from the_greenhouse.users.forms import RegisterForm, LoginForm, UpdateUserForm, add_unique_errors
+from the_greenhouse.users.pfp_handler import process_profile_pic, save_upload, UploadTooLarge, avatar_dir, avatar_url, avatar_srcset, is_legacy_avatar
+from the_greenhouse.query_profiles import load_profile
+from the_greenhouse.query_budget import query_budget
+from the_greenhouse.replicas import read_only
+from the_greenhouse.conditional import conditional, user_events_version, touch_user_events
+from the_greenhouse.pagination import keyset_paginate
+from the_greenhouse.core.feed_cache import invalidate_user
+from the_greenhouse.users.calendar_data import month_data, month_json
+from the_greenhouse.users.ics_feed import feed_token, user_id_from_token, feed_version, generate_feed
 from datetime import date
-import calendar
 import os
 
 users = Blueprint('users', __name__)
 
+users.add_app_template_global(avatar_url)
+users.add_app_template_global(avatar_srcset)
+users.add_app_template_global(is_legacy_avatar)
+
+@jobs.handler('profile_pic')
+def profile_pic_ready(context, result):
+    current_app.logger.info('Profile picture processed for user %s: %s', context['user_id'], result['metrics'])
+    
+    # Switch to the new avatar only once every size has been written
+    user = db.session.get(User, context['user_id'])
+    if user is not None:
+        user.profile_image = result['profile_image']
+        touch_user_events(user.id)
+        db.session.commit()
+        invalidate_user(user.id)
+
 @users.route('/logout')
 def logout():
-    print("Logging out")
     logout_user()
     return redirect(url_for('core.index'))
 
@@ -27,15 +50,21 @@ def register():
                     password = form.password.data)
         
         db.session.add(user)
-        db.session.commit()
-        flash('Thanks for joining The Greenhouse!', 'success')
-        return redirect(url_for('users.login'))
+        try:
+            db.session.commit()
+        except IntegrityError as error:
+            # Someone registered the same email or username since validation
+            db.session.rollback()
+            if not add_unique_errors(form, error):
+                raise
+        else:
+            flash('Thanks for joining The Greenhouse!', 'success')
+            return redirect(url_for('users.login'))
     
-    else:
-        # Show specific form validation errors
-        for field, errors in form.errors.items():
-            for error in errors:
-                flash(f'{error}', 'error')
+    # Show specific form validation errors
+    for field, errors in form.errors.items():
+        for error in errors:
+            flash(f'{error}', 'error')
     
     return render_template('register.html', form = form)
 
@@ -47,6 +76,8 @@ def login():
         user = db.session.execute(select(User).filter_by(email = form.email.data)).scalar_one_or_none()
         if user is not None:
             if user.check_password(form.password.data):
+                if user.upgrade_password(form.password.data):
+                    db.session.commit()
                 login_user(user)
                 flash('Log In Successful!', 'success')
 
@@ -66,67 +97,6 @@ def login():
 @users.route('/account', methods = ['GET', 'POST'])
 @login_required
 def account():
-    # Get calendar month and year from request parameters
-    month = request.args.get('month', type=int)
-    year = request.args.get('year', type=int)
-    
-    # Default to current month/year if not provided
-    if not month or not year:
-        today = date.today()
-        month = today.month
-        year = today.year
-    
-    # Ensure month is between 1-12
-    month = max(1, min(12, month))
-    
-    # Get the first day of the month and calculate calendar data
-    first_day = date(year, month, 1)
-    last_day = date(year, month, calendar.monthrange(year, month)[1])
-    
-    # Get all events the user is attending in this month
-    user_events = db.session.scalars(
-        select(Events)
-        .join(EventAttendee, Events.id == EventAttendee.event_id)
-        .where(
-            and_(
-                EventAttendee.user_id == current_user.id,
-                Events.event_date >= first_day,
-                Events.event_date <= last_day
-            )
-        )
-        .order_by(Events.event_date, Events.event_time)
-    ).all()
-    
-    # Create a dictionary of events by date for easy lookup
-    events_by_date = {}
-    for event in user_events:
-        event_date = event.event_date
-        if event_date not in events_by_date:
-            events_by_date[event_date] = []
-        events_by_date[event_date].append(event)
-    
-    # Create a list of all dates in the month for template iteration
-    month_dates = []
-    for day in range(1, last_day.day + 1):
-        month_dates.append(date(year, month, day))
-    
-    # Calculate calendar grid
-    # Get the first day of the week for the first day of the month
-    first_weekday = first_day.weekday()  # Monday is 0, Sunday is 6
-    # Adjust for Sunday start (if you want Sunday to be the first day)
-    # first_weekday = (first_weekday + 1) % 7
-    
-    # Calculate previous and next month for navigation
-    if month == 1:
-        prev_month, prev_year = 12, year - 1
-    else:
-        prev_month, prev_year = month - 1, year
-    
-    if month == 12:
-        next_month, next_year = 1, year + 1
-    else:
-        next_month, next_year = month + 1, year
-
     form = UpdateUserForm()
     if form.validate_on_submit():
 
@@ -142,16 +112,34 @@ def account():
             # Create temp directory if it doesn't exist
             os.makedirs(os.path.dirname(temp_path), exist_ok=True)
             
-            form.picture.data.save(temp_path)
+            try:
+                save_upload(form.picture.data, temp_path, current_app.config['UPLOAD_MAX_BYTES'])
+            except UploadTooLarge:
+                flash(f"Profile pictures can be at most {current_app.config['UPLOAD_MAX_BYTES'] // (1024 * 1024)} MB", 'error')
+                return redirect(url_for('users.account'))
             
             # Store temp filename in session for cropping
             session['temp_image'] = temp_filename
             
             return redirect(url_for('users.crop_image'))
         
-        current_user.username = form.username.data
-        current_user.email = form.email.data
-        db.session.commit()
+        # current_user is a read-only snapshot, changes go to the row
+        user = db.session.get(User, current_user.id)
+        user.username = form.username.data
+        user.email = form.email.data
+        if user.username != current_user.username:
+            touch_user_events(user.id)
+        try:
+            db.session.commit()
+        except IntegrityError as error:
+            db.session.rollback()
+            if not add_unique_errors(form, error):
+                raise
+            for errors in form.errors.values():
+                for message in errors:
+                    flash(message, 'error')
+            return redirect(url_for('users.account'))
+        invalidate_user(user.id)
         flash('Your account has been updated', 'success')
         return redirect(url_for('users.account'))
     
@@ -159,21 +147,49 @@ def account():
         form.username.data = current_user.username
         form.email.data = current_user.email
     
+    # Only pages that are rendered need the calendar, not successful updates
+    month = request.args.get('month', type=int)
+    year = request.args.get('year', type=int)
+    if not month or not year:
+        today = date.today()
+        month, year = today.month, today.year
+
     return render_template('account.html', 
                          form=form, 
-                         events_by_date=events_by_date,
-                         month=month,
-                         year=year,
-                         first_day=first_day,
-                         last_day=last_day,
-                         first_weekday=first_weekday,
-                         prev_month=prev_month,
-                         prev_year=prev_year,
-                         next_month=next_month,
-                         next_year=next_year,
-                         month_name=calendar.month_name[month],
+                         avatar_job=session.get('avatar_job'),
                          today=date.today(),
-                         month_dates=month_dates)
+                         feed_url=url_for('users.calendar_feed', token=feed_token(current_user.id), _external=True),
+                         **month_data(current_user.id, year, month))
+
+@users.route('/account/calendar/<int:year>/<int:month>')
+@login_required
+def calendar_month(year, month):
+    # Month data for navigating the account calendar without reloading the page
+    if not 1 <= month <= 12 or not date.min.year < year < date.max.year:
+        abort(404)
+    return jsonify(month_json(month_data(current_user.id, year, month)))
+
+@users.route('/calendar/<token>.ics')
+def calendar_feed(token):
+    # For calendar apps, which poll with If-None-Match / If-Modified-Since
+    user_id = user_id_from_token(token)
+    if user_id is None:
+        abort(404)
+    etag, last_modified = version = feed_version(user_id)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = request.if_modified_since is not None and request.if_modified_since >= last_modified
+    if not_modified:
+        response = Response(status=304)
+    else:
+        response = Response(stream_with_context(generate_feed(user_id, version)), mimetype='text/calendar')
+        response.headers['Content-Disposition'] = 'inline; filename="greenhouse.ics"'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 @users.route('/crop_image', methods = ['GET', 'POST'])
 @login_required
@@ -198,28 +214,49 @@ def crop_image():
         
         crop_data = (crop_x, crop_y, crop_width, crop_height)
         
-        # Process the image with cropping
-        username = current_user.username
-        pic = add_profile_pic(temp_path, username, crop_data)
-        current_user.profile_image = pic
+        # Process the image with cropping in the background, the old picture is shown until it is done
+        job_id = jobs.submit('profile_pic', process_profile_pic, temp_path, avatar_dir(), crop_data, True,
+                             context = {'user_id': current_user.id})
         
-        current_user.username = request.form.get('username', current_user.username)
-        current_user.email = request.form.get('email', current_user.email)
+        user = db.session.get(User, current_user.id)
+        user.username = request.form.get('username', user.username)
+        user.email = request.form.get('email', user.email)
+        if user.username != current_user.username:
+            touch_user_events(user.id)
         
         db.session.commit()
+        invalidate_user(user.id)
         
-        # Clean up temp file
-        os.remove(temp_path)
+        # The job removes the temp file once it has been processed
         session.pop('temp_image', None)
+        session['avatar_job'] = job_id
         
-        flash('Your profile picture has been updated!', 'success')
+        flash('Your profile picture is being updated and will appear shortly.', 'success')
         return redirect(url_for('users.account'))
     
     # Show crop interface
     image_url = url_for('static', filename='temp/' + temp_filename)
     return render_template('crop_image.html', image_url=image_url)
 
+@users.route('/crop_image/status/<job_id>')
+@login_required
+def avatar_status(job_id):
+    job = jobs.status(job_id)
+    if job is None or job['context'].get('user_id') != current_user.id:
+        abort(404)
+    
+    if job['status'] in ('done', 'failed'):
+        session.pop('avatar_job', None)
+    
+    profile_image = None
+    if job['status'] == 'done':
+        profile_image = avatar_url(job['result']['profile_image'], 300)
+    return jsonify(status=job['status'], profile_image=profile_image)
+
 @users.route('/<username>')
+@read_only
+@conditional(user_events_version)
+@query_budget(4)
 def user_events(username):
     page = request.args.get('page', 1, type = int)
     stmt = select(User).where(User.username == username)
@@ -228,11 +265,22 @@ def user_events(username):
     if user is None:
         abort(404)
 
-    events = db.paginate(
-        select(Events).where(Events.author == user).order_by(desc(Events.created_date)),
-        page=page,
-        per_page=5,
-        error_out=False
-    )
+    # Older events may have been archived, AnyEvent reads both tables
+    query = select(AnyEvent).options(*load_profile('any_event_feed')).where(AnyEvent.user_id == user.id)
+    if current_app.config['PAGINATION_MODE'] == 'keyset' and 'page' not in request.args:
+        events = keyset_paginate(
+            query,
+            (AnyEvent.created_date, AnyEvent.id),
+            cursor=request.args.get('cursor'),
+            per_page=5,
+            total=None
+        )
+    else:
+        events = db.paginate(
+            query.order_by(desc(AnyEvent.created_date)),
+            page=page,
+            per_page=5,
+            error_out=False
+        )
 
     return render_template('user_events.html', events = events, user = user)
\ No newline at end of file